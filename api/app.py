@@ -1,11 +1,19 @@
+import asyncio
+import threading
+
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
+from auth import cleanup_expired, flush_token_usage, preload_device_sites, run_authz_listener
+import db
 import mqtt_publisher
+from utils.logging import setup_logger
 
 from routers import auth, users, tokens, devices, sensors, sites, plant_profiles, predictions, ui, calendar
 
+logger = setup_logger("app")
+
 app = FastAPI(docs_url=None, redoc_url=None, title="Smart Allotment API")
 
 # Allow all origins for now — tighten this down in production
@@ -21,8 +29,36 @@ app.add_middleware(
 # Serve static files (CSS, JS) and HTML templates from fixed container paths
 app.mount("/static", StaticFiles(directory="/api/static"), name="static")
 
+CLEANUP_INTERVAL = 3600  # seconds
+TOKEN_USAGE_FLUSH_INTERVAL = 30  # seconds
+
 # -------------------------
-# Startup
+# Background jobs
+# -------------------------
+
+async def cleanup_expired_periodically():
+    """Purge expired sessions and API tokens hourly instead of on every authenticated request"""
+    while True:
+        await asyncio.sleep(CLEANUP_INTERVAL)
+        try:
+            deleted = await asyncio.to_thread(cleanup_expired)
+            if any(deleted.values()):
+                logger.info("Removed %s expired sessions, %s expired API tokens", deleted['sessions'], deleted['api_tokens'])
+        except Exception as e:
+            logger.warning("Expired row cleanup failed: %s", e)
+
+
+async def flush_token_usage_periodically():
+    """Write API tokens' last_used timestamps in one batch every 30s instead of per request"""
+    while True:
+        await asyncio.sleep(TOKEN_USAGE_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(flush_token_usage)
+        except Exception as e:
+            logger.warning("Token usage flush failed: %s", e)
+
+# -------------------------
+# Startup / shutdown
 # -------------------------
 
 @app.on_event("startup")
@@ -31,6 +67,36 @@ async def startup():
     # so all endpoints can publish without creating a new connection each time
     mqtt_publisher.connect()
 
+    # Open the DB pool's minimum connections up front so the first page loads
+    # after a restart don't each pay a Postgres handshake. A DB that isn't up
+    # yet shouldn't stop the API booting — the pool fills lazily instead.
+    try:
+        warmed = await asyncio.to_thread(db.warm_pool)
+        logger.info("Warmed %s database connections", warmed)
+        # Device → site lookups back nearly every access check; load them all at once
+        devices = await asyncio.to_thread(preload_device_sites)
+        logger.info("Cached sites for %s devices", devices)
+    except Exception as e:
+        logger.warning("Could not warm database pool or caches: %s", e)
+
+    app.state.cleanup = asyncio.create_task(cleanup_expired_periodically())
+    app.state.token_usage_flush = asyncio.create_task(flush_token_usage_periodically())
+
+    # Evict cached roles/sessions/device sites as soon as the DB reports a change
+    threading.Thread(target=run_authz_listener, name="authz-listener", daemon=True).start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.cleanup.cancel()
+    app.state.token_usage_flush.cancel()
+
+    # Don't lose the last interval's token usage
+    try:
+        await asyncio.to_thread(flush_token_usage)
+    except Exception as e:
+        logger.warning("Token usage flush failed: %s", e)
+
 # -------------------------
 # Routers
 # -------------------------
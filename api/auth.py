@@ -2,37 +2,105 @@
 Authentication and Authorization utilities for Smart Allotment.
 Covers password hashing, session management, API tokens, and access control.
 """
+import hashlib
+import os
 import secrets
+import select
+import threading
+import time
 import bcrypt
-from datetime import datetime, timedelta
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError, InvalidHashError
+from cachetools import TTLCache
+from datetime import datetime, timezone
 from typing import Optional, Dict, Any
-from db import get_connection
+from psycopg2.extras import RealDictCursor, execute_values
+from db import db_conn, execute_prepared, open_listen_connection
+from utils.logging import setup_logger
+
+logger = setup_logger("auth")
 
 # ============================================
 # PASSWORD HASHING
 # ============================================
 
+# argon2id cost — memory-hard, so GPU guessing gets expensive. Tunable per host;
+# raising these makes existing hashes get upgraded on the next login.
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "2"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))  # KiB (64 MiB)
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+
+# Each hash is ~50ms of CPU and ARGON2_MEMORY_COST of RAM, so a login storm could
+# otherwise occupy every threadpool worker at once. Excess logins queue here.
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(os.cpu_count() or 2)))
+
+# One shared hasher — building a PasswordHasher is not free, so do it once at import.
+_password_hasher = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM,
+)
+_hash_slots = threading.BoundedSemaphore(PASSWORD_HASH_CONCURRENCY)
+
+# Verified against when a username doesn't exist, so an unknown user costs the
+# same hashing time as a wrong password and login timing doesn't reveal which usernames exist
+_DUMMY_PASSWORD_HASH = _password_hasher.hash(secrets.token_urlsafe(16))
+
+
 def hash_password(password: str) -> str:
-    """Hash a plaintext password using bcrypt (includes a random salt automatically)"""
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+    """Hash a plaintext password using argon2id (includes a random salt automatically)"""
+    with _hash_slots:
+        return _password_hasher.hash(password)
 
 
 def verify_password(password: str, password_hash: str) -> bool:
-    """Check a plaintext password against a stored bcrypt hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    """
+    Check a plaintext password against a stored hash.
+    Accepts argon2id hashes and legacy bcrypt hashes ($2b$...) from before the switch.
+    """
+    with _hash_slots:
+        if password_hash.startswith("$argon2"):
+            try:
+                return _password_hasher.verify(password_hash, password)
+            except (VerifyMismatchError, InvalidHashError):
+                return False
+
+        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+def password_needs_rehash(password_hash: str) -> bool:
+    """True if the hash is legacy bcrypt or uses outdated argon2 parameters"""
+    if not password_hash.startswith("$argon2"):
+        return True
+    return _password_hasher.check_needs_rehash(password_hash)
 
 # ============================================
 # API TOKEN MANAGEMENT
 # ============================================
 
+# Devices validate their token on every upload, so validated tokens are cached
+# in-process by token hash. Revocation evicts the entry here and, through the
+# authz_changed NOTIFY, in every other worker; the TTL is only a backstop.
+TOKEN_CACHE_TTL = int(os.getenv("AUTH_TOKEN_CACHE_TTL", "60"))
+
+_token_cache = TTLCache(maxsize=4096, ttl=TOKEN_CACHE_TTL)  # token hash → token info
+_token_cache_lock = threading.Lock()
+
+def hash_api_token(token: str) -> bytes:
+    """
+    SHA-256 digest of a raw API token — the only form stored in the DB.
+    Tokens are 256 random bits, so a fast unsalted hash is enough (unlike passwords).
+    """
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+
 def generate_api_token(prefix: str = "api") -> str:
     """
     Generate a cryptographically secure API token.
-    Format: {prefix}_{64-char hex string}
-    Example: dev_a3f9bc... or usr_12cd8e...
+    Format: {prefix}_{43-char URL-safe base64 string} (256 random bits)
+    Example: dev_a3F9-c... or usr_12cD_e...
     """
-    random_part = secrets.token_hex(32)  # 64 character hex string
+    random_part = secrets.token_urlsafe(32)  # 43 character URL-safe string
     return f"{prefix}_{random_part}"
 
 
@@ -59,97 +127,135 @@ def create_api_token(
     
     scopes = scopes or []
 
-    # Calculate expiry if a lifespan was requested; None = never expires
-    expires_at = None
-    if expires_days:
-        expires_at = datetime.now() + timedelta(days=expires_days)
+    with db_conn() as conn:
+        cur = conn.cursor()
     
-    conn = get_connection()
-    cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO api_tokens (token_hash, user_id, device_id, name, description, scopes, expires_at, created_by)
+            VALUES (%s, %s, %s, %s, %s, %s, NOW() + make_interval(days => %s), %s)
+            RETURNING id, name, scopes, expires_at, created_at;
+        """, (hash_api_token(token), user_id, device_id, name, description, scopes,
+              expires_days or None,  # NULL interval → NULL expires_at = never expires
+              created_by))
     
-    cur.execute("""
-        INSERT INTO api_tokens (token, user_id, device_id, name, description, scopes, expires_at, created_by)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        RETURNING id, token, name, scopes, expires_at, created_at;
-    """, (token, user_id, device_id, name, description, scopes, expires_at, created_by))
-    
-    row = cur.fetchone()
-    conn.commit()
-    conn.close()
+        row = cur.fetchone()
+        conn.commit()
     
     return {
         "id": row[0],
-        "token": row[1], # Raw token — only returned here, never stored in plaintext
-        "name": row[2],
-        "scopes": row[3],
-        "expires_at": row[4],
-        "created_at": row[5]
+        "token": token, # Raw token — only returned here, never stored in plaintext
+        "name": row[1],
+        "scopes": row[2],
+        "expires_at": row[3],
+        "created_at": row[4]
     }
 
 
+# last_used is an audit column, so instead of an UPDATE per request the latest
+# use of each token is held here and written in one batch by flush_token_usage()
+_token_last_used: Dict[bytes, datetime] = {}  # token hash → last use
+_token_last_used_lock = threading.Lock()
+
+
+def _record_token_use(token_hash: bytes):
+    with _token_last_used_lock:
+        _token_last_used[token_hash] = datetime.now(timezone.utc)
+
+
+def flush_token_usage() -> int:
+    """Write pending last_used timestamps in a single UPDATE. Returns how many tokens were updated."""
+    with _token_last_used_lock:
+        if not _token_last_used:
+            return 0
+        pending = list(_token_last_used.items())
+        _token_last_used.clear()
+
+    try:
+        with db_conn() as conn:
+            cur = conn.cursor()
+            execute_values(cur, """
+                UPDATE api_tokens SET last_used = v.used_at
+                FROM (VALUES %s) AS v(token_hash, used_at)
+                WHERE api_tokens.token_hash = v.token_hash;
+            """, pending)
+            conn.commit()
+    except Exception:
+        # Put them back (without overwriting newer uses) so the next flush retries
+        with _token_last_used_lock:
+            for token_hash, used_at in pending:
+                _token_last_used.setdefault(token_hash, used_at)
+        raise
+
+    return len(pending)
+
+
 def validate_api_token(token: str) -> Optional[Dict[str, Any]]:
     """
     Validate an API token from an Authorization header.
-    Cleans up expired tokens as a side effect.
+    Served from the token cache when possible, otherwise from the DB (and cached).
     Returns enriched token info (with user/device details) if valid, None if not.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    # Housekeeping: remove expired tokens before checking
-    cur.execute("DELETE FROM api_tokens WHERE expires_at < NOW() AND expires_at IS NOT NULL;")
-    
-    # Fetch the token along with its associated user or device info
-    cur.execute("""
-        SELECT 
-            t.id, t.token, t.user_id, t.device_id, t.name, t.scopes, t.expires_at,
-            u.username, u.role, u.email,
-            d.uid as device_uid, d.site_id
-        FROM api_tokens t
-        LEFT JOIN users u ON t.user_id = u.id
-        LEFT JOIN devices d ON t.device_id = d.id
-        WHERE t.token = %s 
-        AND t.active = TRUE
-        AND (t.expires_at IS NULL OR t.expires_at > NOW());
-    """, (token,))
-    
-    row = cur.fetchone()
+    token_hash = hash_api_token(token)
+
+    with _token_cache_lock:
+        cached = _token_cache.get(token_hash)
+
+    if cached is not None:
+        expires_at = cached["expires_at"]
+        if expires_at is None or expires_at > datetime.now(timezone.utc):
+            _record_token_use(token_hash)
+            return dict(cached)  # Copy so callers can't mutate the cached entry
+        with _token_cache_lock:
+            _token_cache.pop(token_hash, None)
+        return None
+
+    with db_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+        # Fetch the token along with its associated user or device info
+        execute_prepared(cur, "token_validate", """
+            SELECT 
+                t.id AS token_id, t.user_id, t.device_id, t.name AS token_name,
+                t.scopes, t.expires_at,
+                u.username, u.role, u.email,
+                ARRAY(SELECT a.site_id FROM user_site_assignments a WHERE a.user_id = t.user_id) AS site_ids,
+                d.uid AS device_uid, d.site_id AS device_site_id
+            FROM api_tokens t
+            LEFT JOIN users u ON t.user_id = u.id
+            LEFT JOIN devices d ON t.device_id = d.id
+            WHERE t.token_hash = %s
+            AND t.active = TRUE
+            AND (t.expires_at IS NULL OR t.expires_at > NOW());
+        """, (token_hash,))
+    
+        row = cur.fetchone()
     
     if not row:
-        conn.close()
         return None
-    
-    # Record when this token was last used (useful for auditing)
-    cur.execute("""
-        UPDATE api_tokens SET last_used = NOW() WHERE token = %s;
-    """, (token,))
-    
-    conn.commit()
-    conn.close()
-    
-    result = {
-        "token_id": row[0],
-        "token": row[1],
-        "user_id": row[2],
-        "device_id": row[3],
-        "token_name": row[4],
-        "scopes": row[5] or [],
-        "expires_at": row[6],
-        "type": "user" if row[2] else "device" # Tells callers which kind of token this is
-    }
-    
-    # Attach user details if this is a user token
-    if row[2]:
-        result["username"] = row[7]
-        result["role"] = row[8]
-        result["email"] = row[9]
-    
-    # Attach device details if this is a device token
-    if row[3]:
-        result["device_uid"] = row[10]
-        result["device_site_id"] = row[11]
-    
-    return result
+
+    _record_token_use(token_hash)
+
+    result = dict(row)
+    result["token"] = token
+    result["scopes"] = result["scopes"] or []
+    result["type"] = "user" if row["user_id"] else "device"  # Tells callers which kind of token this is
+    _index_scopes(result)
+
+    # Keep only the owner's details — user fields for user tokens, device fields for device tokens
+    site_ids = result.pop("site_ids")
+    if row["user_id"]:
+        # Preloaded so token_can_access_device can answer without a query
+        result["_site_ids"] = frozenset(site_ids)
+    else:
+        for key in ("username", "role", "email"):
+            del result[key]
+    if not row["device_id"]:
+        for key in ("device_uid", "device_site_id"):
+            del result[key]
+
+    with _token_cache_lock:
+        _token_cache[token_hash] = result
+    return dict(result)
 
 
 def revoke_api_token(token: str) -> bool:
@@ -157,74 +263,77 @@ def revoke_api_token(token: str) -> bool:
     Soft-delete a token by marking it inactive.
     Returns True if a row was updated, False if the token wasn't found.
     """
-    conn = get_connection()
-    cur = conn.cursor()
+    return revoke_api_token_hash(hash_api_token(token))
+
+
+def revoke_api_token_hash(token_hash: bytes) -> bool:
+    """Same as revoke_api_token, for callers that only have the stored hash"""
+    with _token_cache_lock:
+        _token_cache.pop(token_hash, None)
+
+    with db_conn() as conn:
+        cur = conn.cursor()
     
-    cur.execute("""
-        UPDATE api_tokens SET active = FALSE WHERE token = %s;
-    """, (token,))
+        cur.execute("""
+            UPDATE api_tokens SET active = FALSE WHERE token_hash = %s;
+        """, (token_hash,))
     
-    affected = cur.rowcount
-    conn.commit()
-    conn.close()
+        affected = cur.rowcount
+        conn.commit()
     
     return affected > 0
 
 
-def list_user_tokens(user_id: int) -> list:
-    """Return all tokens belonging to a user, newest first. Token values are not included."""
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        SELECT id, name, scopes, active, last_used, expires_at, created_at
-        FROM api_tokens
-        WHERE user_id = %s
-        ORDER BY created_at DESC;
-    """, (user_id,))
-    
-    tokens = []
-    for row in cur.fetchall():
-        tokens.append({
-            "id": row[0],
-            "name": row[1],
-            "scopes": row[2],
-            "active": row[3],
-            "last_used": row[4],
-            "expires_at": row[5],
-            "created_at": row[6]
-        })
-    
-    conn.close()
-    return tokens
-
-
-def list_device_tokens(device_id: int) -> list:
-    """Return all tokens associated with a device, newest first."""
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        SELECT id, name, scopes, active, last_used, expires_at, created_at
-        FROM api_tokens
-        WHERE device_id = %s
-        ORDER BY created_at DESC;
-    """, (device_id,))
-    
-    tokens = []
-    for row in cur.fetchall():
-        tokens.append({
-            "id": row[0],
-            "name": row[1],
-            "scopes": row[2],
-            "active": row[3],
-            "last_used": row[4],
-            "expires_at": row[5],
-            "created_at": row[6]
-        })
-    
-    conn.close()
-    return tokens
+def list_user_tokens(user_id: int, limit: int = 50, offset: int = 0) -> list:
+    """Return a page of the tokens belonging to a user, newest first. Token values are not included."""
+    with db_conn() as conn:
+        # Rows come back as dicts straight from the cursor
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+        cur.execute("""
+            SELECT id, name, scopes, active, last_used, expires_at, created_at
+            FROM api_tokens
+            WHERE user_id = %s
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s OFFSET %s;
+        """, (user_id, limit, offset))
+    
+        return cur.fetchall()
+
+
+def list_device_tokens(device_id: int, limit: int = 50, offset: int = 0) -> list:
+    """Return a page of the tokens associated with a device, newest first."""
+    with db_conn() as conn:
+        # Rows come back as dicts straight from the cursor
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+    
+        cur.execute("""
+            SELECT id, name, scopes, active, last_used, expires_at, created_at
+            FROM api_tokens
+            WHERE device_id = %s
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s OFFSET %s;
+        """, (device_id, limit, offset))
+    
+        return cur.fetchall()
+
+
+def invalidate_tokens(user_id: Optional[int] = None, device_uid: Optional[str] = None):
+    """Drop every cached token belonging to a user or device — call after changing its owner"""
+    with _token_cache_lock:
+        for token, info in list(_token_cache.items()):
+            if (user_id is not None and info["user_id"] == user_id) or \
+               (device_uid is not None and info.get("device_uid") == device_uid):
+                del _token_cache[token]
+
+
+def _index_scopes(token_info: Dict[str, Any]):
+    """Precompute scope lookups once per validated token so check_token_scope is O(1)"""
+    scopes = token_info.get("scopes", [])
+    token_info["_scope_set"] = frozenset(scopes)
+    token_info["_scope_prefixes"] = frozenset(
+        s.split(":", 1)[0] for s in scopes if s.endswith(":*")
+    )
 
 
 def check_token_scope(token_info: Dict[str, Any], required_scope: str) -> bool:
@@ -237,7 +346,10 @@ def check_token_scope(token_info: Dict[str, Any], required_scope: str) -> bool:
       2. Exact match      → e.g. 'write:sensor_data' matches 'write:sensor_data'
       3. Wildcard prefix  → e.g. 'read:*' matches 'read:sensors'
     """
-    scopes = token_info.get("scopes", [])
+    if "_scope_set" not in token_info:
+        _index_scopes(token_info)
+
+    scopes = token_info["_scope_set"]
     
     # Admin wildcard
     if "admin:*" in scopes:
@@ -249,10 +361,8 @@ def check_token_scope(token_info: Dict[str, Any], required_scope: str) -> bool:
     
     # Check if a wildcard like 'read:*' covers the required scope
     scope_parts = required_scope.split(":")
-    if len(scope_parts) == 2:
-        wildcard = f"{scope_parts[0]}:*"
-        if wildcard in scopes:
-            return True
+    if len(scope_parts) == 2 and scope_parts[0] in token_info["_scope_prefixes"]:
+        return True
     
     return False
 
@@ -260,6 +370,35 @@ def check_token_scope(token_info: Dict[str, Any], required_scope: str) -> bool:
 # SESSION MANAGEMENT
 # ============================================
 
+# Every authenticated page/API call validates its session, so validated sessions
+# are cached in-process by token. The TTL is much shorter than the session itself
+# so that a disabled user or changed role is picked up by every worker quickly.
+SESSION_CACHE_TTL = int(os.getenv("AUTH_SESSION_CACHE_TTL", "300"))
+
+_session_cache = TTLCache(maxsize=10000, ttl=SESSION_CACHE_TTL)  # SHA-256 of session token → user info
+_session_cache_lock = threading.Lock()
+
+
+def _session_key(session_token: str) -> bytes:
+    """
+    Session cache key — the token's SHA-256, which is also what the sessions trigger
+    NOTIFYs, so raw tokens never cross the notification channel.
+    """
+    return hashlib.sha256(session_token.encode('utf-8')).digest()
+
+
+def _session_row_to_user(row) -> Dict[str, Any]:
+    return {
+        "user_id": row[0],
+        "username": row[1],
+        "email": row[2],
+        "full_name": row[3],
+        "role": row[4],
+        "active": row[5],
+        "session_expires": row[6]
+    }
+
+
 def create_session(user_id: int, ip_address: str = None, user_agent: str = None) -> str:
     """
     Create a new browser session for a user after successful login.
@@ -267,72 +406,137 @@ def create_session(user_id: int, ip_address: str = None, user_agent: str = None)
     Returns the session token (stored as an httponly cookie on the client).
     """
     session_token = secrets.token_urlsafe(32)
-    expires_at = datetime.now() + timedelta(hours=24)  # 24 hour sessions
-    
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    cur.execute("""
-        INSERT INTO sessions (user_id, session_token, expires_at, ip_address, user_agent)
-        VALUES (%s, %s, %s, %s, %s)
-        RETURNING session_token;
-    """, (user_id, session_token, expires_at, ip_address, user_agent))
-    
-    token = cur.fetchone()[0]
-    conn.commit()
-    conn.close()
     
+    with db_conn() as conn:
+        cur = conn.cursor()
+    
+        # Insert and read back the user in one statement so the session is cached
+        # from the start and the first page load doesn't go to the DB
+        cur.execute("""
+            WITH s AS (
+                INSERT INTO sessions (user_id, session_token, expires_at, ip_address, user_agent)
+                VALUES (%s, %s, NOW() + INTERVAL '24 hours', %s, %s)
+                RETURNING session_token, user_id, expires_at
+            )
+            SELECT u.id, u.username, u.email, u.full_name, u.role, u.active,
+                   s.expires_at::timestamptz, s.session_token
+            FROM s
+            JOIN users u ON s.user_id = u.id;
+        """, (user_id, session_token, ip_address, user_agent))
+    
+        row = cur.fetchone()
+        conn.commit()
+    
+    token = row[7]
+    if row[5]:
+        with _session_cache_lock:
+            _session_cache[_session_key(token)] = _session_row_to_user(row)
+
     return token
 
 
 def validate_session(session_token: str) -> Optional[Dict[str, Any]]:
     """
     Validate a session cookie token.
-    Cleans up expired sessions as a side effect.
+    Served from the session cache when possible, otherwise from the DB (and cached).
     Returns user info dict if valid, None if expired or not found.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    # Housekeeping: purge expired sessions before checking
-    cur.execute("DELETE FROM sessions WHERE expires_at < NOW();")
+    key = _session_key(session_token)
+    with _session_cache_lock:
+        user = _session_cache.get(key)
+
+    if user is not None:
+        if user["session_expires"] > datetime.now(timezone.utc):
+            return dict(user)  # Copy so callers can't mutate the cached entry
+        with _session_cache_lock:
+            _session_cache.pop(key, None)
+        return None
+
+    with db_conn() as conn:
+        cur = conn.cursor()
     
-    # Join to users so we get role/email etc. in a single query
-    cur.execute("""
-        SELECT 
-            u.id, u.username, u.email, u.full_name, u.role, u.active,
-            s.expires_at
-        FROM sessions s
-        JOIN users u ON s.user_id = u.id
-        WHERE s.session_token = %s AND s.expires_at > NOW() AND u.active = TRUE;
-    """, (session_token,))
+        # Join to users so we get role/email etc. in a single query
+        execute_prepared(cur, "session_validate", """
+            SELECT 
+                u.id, u.username, u.email, u.full_name, u.role, u.active,
+                s.expires_at::timestamptz
+            FROM sessions s
+            JOIN users u ON s.user_id = u.id
+            WHERE s.session_token = %s AND s.expires_at > NOW() AND u.active = TRUE;
+        """, (session_token,))
     
-    row = cur.fetchone()
-    conn.close()
+        row = cur.fetchone()
     
     if not row:
         return None
     
-    return {
-        "user_id": row[0],
-        "username": row[1],
-        "email": row[2],
-        "full_name": row[3],
-        "role": row[4],
-        "active": row[5],
-        "session_expires": row[6]
-    }
+    user = _session_row_to_user(row)
+    with _session_cache_lock:
+        _session_cache[key] = user
+    return dict(user)
 
 
 def delete_session(session_token: str):
     """Remove a session from the DB (called on logout)"""
-    conn = get_connection()
-    cur = conn.cursor()
+    with _session_cache_lock:
+        _session_cache.pop(_session_key(session_token), None)
+
+    with db_conn() as conn:
+        cur = conn.cursor()
     
-    cur.execute("DELETE FROM sessions WHERE session_token = %s;", (session_token,))
+        cur.execute("DELETE FROM sessions WHERE session_token = %s;", (session_token,))
     
-    conn.commit()
-    conn.close()
+        conn.commit()
+
+
+def invalidate_user_sessions(user_id: int):
+    """Drop every cached session for a user — call after disabling, editing or deleting them"""
+    with _session_cache_lock:
+        for key, user in list(_session_cache.items()):
+            if user["user_id"] == user_id:
+                del _session_cache[key]
+
+
+# ============================================
+# EXPIRED ROW CLEANUP
+# ============================================
+
+# Rows deleted per statement/commit, so a large backlog never becomes one long
+# transaction holding locks on a hot table
+CLEANUP_BATCH_SIZE = 1000
+
+
+def _delete_expired(table: str, batch_size: int) -> int:
+    deleted = 0
+    with db_conn() as conn:
+        cur = conn.cursor()
+        while True:
+            cur.execute(f"""
+                DELETE FROM {table}
+                WHERE id IN (
+                    SELECT id FROM {table}
+                    WHERE expires_at < NOW()
+                    LIMIT %s
+                );
+            """, (batch_size,))
+            count = cur.rowcount
+            conn.commit()
+            deleted += count
+            if count < batch_size:
+                return deleted
+
+
+def cleanup_expired(batch_size: int = CLEANUP_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Delete expired sessions and API tokens in batches.
+    Run periodically in the background — validation already ignores expired rows,
+    so nothing on the request path needs them gone.
+    Returns how many rows were removed from each table.
+    """
+    return {
+        "sessions": _delete_expired("sessions", batch_size),
+        "api_tokens": _delete_expired("api_tokens", batch_size),
+    }
 
 
 # ============================================
@@ -344,37 +548,48 @@ def authenticate_user(username: str, password: str) -> Optional[Dict[str, Any]]:
     Verify a username/password pair.
     Returns user info on success, None on failure (wrong credentials or inactive account).
     Also updates last_login timestamp on success.
+    Blocking (password hashing) — call from a sync route or a worker thread, never the event loop.
     """
-    conn = get_connection()
-    cur = conn.cursor()
+    with db_conn() as conn:
+        cur = conn.cursor()
     
-    # Only fetch active users — deactivated accounts are treated as non-existent
-    cur.execute("""
-        SELECT id, username, email, password_hash, full_name, role, active
-        FROM users
-        WHERE username = %s AND active = TRUE;
-    """, (username,))
+        # Only fetch active users — deactivated accounts are treated as non-existent
+        execute_prepared(cur, "user_by_username", """
+            SELECT id, username, email, password_hash, full_name, role, active
+            FROM users
+            WHERE username = %s AND active = TRUE;
+        """, (username,))
     
-    row = cur.fetchone()
+        row = cur.fetchone()
     
     if not row:
-        conn.close()
+        verify_password(password, _DUMMY_PASSWORD_HASH)
         return None
-    
+
     user_id, username, email, password_hash, full_name, role, active = row
-    
-    # bcrypt comparison — timing-safe
+
+    # argon2/bcrypt comparison — timing-safe. Done without holding a pooled
+    # connection, since it's the slow part of a login.
     if not verify_password(password, password_hash):
-        conn.close()
         return None
+
+    # Upgrade legacy bcrypt hashes to argon2id now that we know the plaintext
+    new_hash = hash_password(password) if password_needs_rehash(password_hash) else None
+
+    with db_conn() as conn:
+        cur = conn.cursor()
+
+        # Track when the user last logged in
+        cur.execute("""
+            UPDATE users SET last_login = NOW() WHERE id = %s;
+        """, (user_id,))
+
+        if new_hash:
+            cur.execute("""
+                UPDATE users SET password_hash = %s WHERE id = %s;
+            """, (new_hash, user_id))
     
-    # Track when the user last logged in
-    cur.execute("""
-        UPDATE users SET last_login = NOW() WHERE id = %s;
-    """, (user_id,))
-    
-    conn.commit()
-    conn.close()
+        conn.commit()
     
     return {
         "user_id": user_id,
@@ -385,6 +600,205 @@ def authenticate_user(username: str, password: str) -> Optional[Dict[str, Any]]:
     }
 
 
+# ============================================
+# AUTHORIZATION CACHE
+# ============================================
+# Roles, site assignments and device sites change rarely but are checked on
+# almost every request, so they're cached in-process with a TTL. Anything that
+# writes users/user_site_assignments must call invalidate_user_access(); with
+# several workers the TTL bounds how long another process can serve stale access.
+
+ACCESS_CACHE_TTL = int(os.getenv("AUTH_ACCESS_CACHE_TTL", "300"))
+DEVICE_SITE_CACHE_TTL = int(os.getenv("AUTH_DEVICE_SITE_CACHE_TTL", "3600"))
+
+_access_cache = TTLCache(maxsize=10000, ttl=ACCESS_CACHE_TTL)            # user_id → (role, site_ids)
+_device_site_cache = TTLCache(maxsize=10000, ttl=DEVICE_SITE_CACHE_TTL)  # device uid → site_id
+_cache_lock = threading.Lock()  # TTLCache is not thread-safe
+_MISSING = object()
+
+
+def _get_user_access(user_id: int) -> Optional[tuple]:
+    """Return (role, site_ids) for a user, or None if the user doesn't exist"""
+    with _cache_lock:
+        access = _access_cache.get(user_id)
+    if access is not None:
+        return access
+
+    with db_conn() as conn:
+        cur = conn.cursor()
+
+        # Role and assigned sites in one round-trip
+        cur.execute("""
+            SELECT u.role,
+                   COALESCE(array_agg(a.site_id) FILTER (WHERE a.site_id IS NOT NULL), '{}')
+            FROM users u
+            LEFT JOIN user_site_assignments a ON a.user_id = u.id
+            WHERE u.id = %s
+            GROUP BY u.id;
+        """, (user_id,))
+
+        row = cur.fetchone()
+
+    if not row:
+        return None  # Unknown users aren't cached
+
+    access = (row[0], tuple(row[1]))
+    with _cache_lock:
+        _access_cache[user_id] = access
+    return access
+
+
+def _get_device_site(device_uid: str):
+    """Return a device's site_id (None if unassigned), or _MISSING if the device doesn't exist"""
+    with _cache_lock:
+        site_id = _device_site_cache.get(device_uid, _MISSING)
+    if site_id is not _MISSING:
+        return site_id
+
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT site_id FROM devices WHERE uid = %s;", (device_uid,))
+        row = cur.fetchone()
+
+    if not row:
+        return _MISSING
+
+    with _cache_lock:
+        _device_site_cache[device_uid] = row[0]
+    return row[0]
+
+
+def preload_device_sites() -> int:
+    """Fill the device → site cache for every device in one query (run at startup)"""
+    with db_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT uid, site_id FROM devices WHERE uid IS NOT NULL;")
+        rows = cur.fetchall()
+
+    with _cache_lock:
+        for uid, site_id in rows:
+            _device_site_cache[uid] = site_id
+    return len(rows)
+
+
+def _load_user_and_device(user_id: int, device_uid: str) -> tuple:
+    """
+    Load and cache a user's access and a device's site together.
+    Returns (access, site_id) — access is None for an unknown user, site_id is _MISSING for an unknown device.
+    """
+    with db_conn() as conn:
+        cur = conn.cursor()
+
+        # Keyed on the user's primary key with the device as an outer-joined
+        # lookup, so an unknown device still yields the user's row
+        cur.execute("""
+            SELECT u.role,
+                   ARRAY(SELECT a.site_id FROM user_site_assignments a WHERE a.user_id = u.id),
+                   d.id IS NOT NULL,
+                   d.site_id
+            FROM users u
+            LEFT JOIN devices d ON d.uid = %s
+            WHERE u.id = %s;
+        """, (device_uid, user_id))
+
+        row = cur.fetchone()
+
+    if not row:
+        return None, _MISSING
+
+    access = (row[0], tuple(row[1]))
+    device_site_id = row[3] if row[2] else _MISSING
+    with _cache_lock:
+        _access_cache[user_id] = access
+        if row[2]:
+            _device_site_cache[device_uid] = device_site_id
+    return access, device_site_id
+
+
+def invalidate_user_access(user_id: int):
+    """Drop a user's cached role/site assignments — call after changing either"""
+    with _cache_lock:
+        _access_cache.pop(user_id, None)
+
+
+def invalidate_device_site(device_uid: str):
+    """Drop a device's cached site — call after registering or moving a device"""
+    with _cache_lock:
+        _device_site_cache.pop(device_uid, None)
+
+
+# --------------------------------------------
+# Cross-worker invalidation (LISTEN/NOTIFY)
+# --------------------------------------------
+# Triggers on users, user_site_assignments, devices, sessions and api_tokens
+# NOTIFY 'authz_changed' with the stale key, so a change made through any worker
+# (or directly in the DB) is evicted everywhere; the TTLs are only a backstop.
+
+AUTHZ_CHANNEL = "authz_changed"
+
+
+def _apply_authz_notification(payload: str):
+    """Evict the cache entry named by a NOTIFY payload (user:<id>, device:<uid>, session:<hex hash>, token:<hex hash>)"""
+    kind, _, key = payload.partition(":")
+    if kind == "user" and key.isdigit():
+        invalidate_user_access(int(key))
+        invalidate_user_sessions(int(key))
+        invalidate_tokens(user_id=int(key))
+    elif kind == "device":
+        invalidate_device_site(key)
+        invalidate_tokens(device_uid=key)
+    elif kind == "session":
+        with _session_cache_lock:
+            _session_cache.pop(bytes.fromhex(key), None)
+    elif kind == "token":
+        with _token_cache_lock:
+            _token_cache.pop(bytes.fromhex(key), None)
+
+
+def clear_authz_caches():
+    """Drop every cached role, device site, session and API token"""
+    with _cache_lock:
+        _access_cache.clear()
+        _device_site_cache.clear()
+    with _session_cache_lock:
+        _session_cache.clear()
+    with _token_cache_lock:
+        _token_cache.clear()
+
+
+def run_authz_listener():
+    """
+    Blocking loop — run in a daemon thread. Listens for authz_changed and evicts
+    cache entries; reconnects after errors, clearing the caches since any change
+    made while disconnected was missed.
+    """
+    reconnecting = False
+    while True:
+        conn = None
+        try:
+            conn = open_listen_connection()
+            conn.cursor().execute(f"LISTEN {AUTHZ_CHANNEL};")
+            if reconnecting:
+                clear_authz_caches()
+            logger.info("Listening for %s notifications", AUTHZ_CHANNEL)
+
+            while True:
+                # Wake at least once a minute so a dead socket is noticed by poll()
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    conn.poll()
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    _apply_authz_notification(conn.notifies.pop(0).payload)
+        except Exception as e:
+            logger.warning("Authz listener disconnected: %s", e)
+            reconnecting = True
+            time.sleep(5)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
 # ============================================
 # AUTHORIZATION
 # ============================================
@@ -393,44 +807,36 @@ def get_user_site_access(user_id: int) -> list[int]:
     """
     Return the list of site IDs a user is allowed to access.
     For sys_admin users, returns an empty list — callers treat empty as "all sites".
+    Served from the access cache; a miss costs one query for role and sites together.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    # Check if user is sys_admin
-    cur.execute("SELECT role FROM users WHERE id = %s;", (user_id,))
-    row = cur.fetchone()
-    
-    if not row:
-        conn.close()
+    access = _get_user_access(user_id)
+
+    if not access:
         return []
-    
-    role = row[0]
-    
+
+    role, site_ids = access
+
     if role == 'sys_admin':
-        conn.close()
         return []  # Convention: empty = unrestricted (sys_admin sees everything)
-    
+
     # For regular users, return only their explicitly assigned sites
-    cur.execute("""
-        SELECT site_id FROM user_site_assignments WHERE user_id = %s;
-    """, (user_id,))
-    
-    site_ids = [row[0] for row in cur.fetchall()]
-    conn.close()
-    
-    return site_ids
+    return list(site_ids)
 
 
 def user_can_access_site(user_id: int, site_id: int) -> bool:
     """Return True if the user has access to the given site"""
-    allowed_sites = get_user_site_access(user_id)
-    
-    # Empty list = sys_admin = access to all sites
-    if not allowed_sites:
+    access = _get_user_access(user_id)
+
+    if not access:
+        return False
+
+    role, site_ids = access
+
+    # sys_admin can access every site
+    if role == 'sys_admin':
         return True
-    
-    return site_id in allowed_sites
+
+    return site_id in site_ids
 
 
 def user_can_access_device(user_id: int, device_uid: str) -> bool:
@@ -439,45 +845,32 @@ def user_can_access_device(user_id: int, device_uid: str) -> bool:
     Access is determined by whether the user has access to the site the device belongs to.
     Devices with no site assigned are only accessible by sys_admin.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    # Fetch role and device site_id in a single CROSS JOIN query
-    cur.execute("""
-        SELECT u.role, d.site_id
-        FROM users u
-        CROSS JOIN devices d
-        WHERE u.id = %s AND d.uid = %s;
-    """, (user_id, device_uid))
-    
-    row = cur.fetchone()
-    
-    if not row:
-        conn.close()
+    with _cache_lock:
+        access = _access_cache.get(user_id)
+        device_site_id = _device_site_cache.get(device_uid, _MISSING)
+
+    if access is None and device_site_id is _MISSING:
+        # Cold on both — fetch role, assignments and device site in one round-trip
+        access, device_site_id = _load_user_and_device(user_id, device_uid)
+    else:
+        access = access or _get_user_access(user_id)
+        if device_site_id is _MISSING:
+            device_site_id = _get_device_site(device_uid)
+
+    if not access or device_site_id is _MISSING:
         return False
-    
-    role, device_site_id = row
-    
+
+    role, site_ids = access
+
     # sys_admin can access everything
     if role == 'sys_admin':
-        conn.close()
         return True
-    
+
     # Unassigned devices are off-limits to regular users
     if device_site_id is None:
-        conn.close()
         return False
-    
-    # Check the user_site_assignments table
-    cur.execute("""
-        SELECT 1 FROM user_site_assignments
-        WHERE user_id = %s AND site_id = %s;
-    """, (user_id, device_site_id))
-    
-    has_access = cur.fetchone() is not None
-    conn.close()
-    
-    return has_access
+
+    return device_site_id in site_ids
 
 def token_can_access_device(token_info: Dict[str, Any], device_uid: str) -> bool:
     """
@@ -492,8 +885,17 @@ def token_can_access_device(token_info: Dict[str, Any], device_uid: str) -> bool
     
     # User tokens follow user permissions
     if token_info["type"] == "user":
-        user_id = token_info["user_id"]
-        return user_can_access_device(user_id, device_uid)
+        site_ids = token_info.get("_site_ids")
+        if site_ids is None:
+            return user_can_access_device(token_info["user_id"], device_uid)
+
+        # Role and sites were loaded with the token — only the device's site is needed
+        device_site_id = _get_device_site(device_uid)
+        if device_site_id is _MISSING:
+            return False
+        if token_info.get("role") == "sys_admin":
+            return True
+        return device_site_id is not None and device_site_id in site_ids
     
     return False
 
@@ -502,30 +904,16 @@ def filter_devices_by_access(user_id: int, devices: list) -> list:
     Filter a list of device dicts to only those the user can access.
     sys_admin receives the full unfiltered list.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    # Check if user is sys_admin
-    cur.execute("SELECT role FROM users WHERE id = %s;", (user_id,))
-    row = cur.fetchone()
-    
-    if not row:
-        conn.close()
+    access = _get_user_access(user_id)
+
+    if not access:
         return []
-    
-    role = row[0]
-    
+
+    role, allowed_sites = access
+
     if role == 'sys_admin':
-        conn.close()
         return devices  # Return all devices
-    
-    # Get the user's allowed site IDs
-    cur.execute("""
-        SELECT site_id FROM user_site_assignments WHERE user_id = %s;
-    """, (user_id,))
-    
-    allowed_sites = [row[0] for row in cur.fetchall()]
-    conn.close()
-    
-    # Keep only devices whose site_id is in the allowed list
-    return [d for d in devices if d.get('site_id') in allowed_sites]
\ No newline at end of file
+
+    # Keep only devices whose site_id is in the allowed set (O(1) membership per device)
+    allowed = set(allowed_sites)
+    return [d for d in devices if d.get('site_id') in allowed]
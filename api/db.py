@@ -1,12 +1,191 @@
 import psycopg2
+import psycopg2.pool
 from psycopg2.extras import RealDictCursor
+from contextlib import contextmanager
+from fastapi import HTTPException
+import itertools
 import os
+import threading
+import time
+import weakref
+
+# ----------------------------------------------------------------------------
+# Connection pool
+# ----------------------------------------------------------------------------
+# Opening a Postgres connection costs a TCP handshake, auth and backend startup,
+# so connections are kept open in a shared pool and handed out per request.
+# The pool is created lazily on first use so the API can boot before the DB is up.
+#
+# ThreadedConnectionPool raises PoolError instead of waiting once maxconn
+# connections are out, and the API can have more threads than that (anyio's
+# default of 40, and handlers that hold a request connection while an auth
+# helper checks out a second one). Checkouts therefore take a slot from
+# _pool_slots first, waiting up to POOL_TIMEOUT seconds before answering 503.
+# ----------------------------------------------------------------------------
+
+POOL_MIN_CONN = int(os.getenv("PSQL_POOL_MIN", "5"))
+POOL_MAX_CONN = int(os.getenv("PSQL_POOL_MAX", "30"))
+POOL_TIMEOUT = float(os.getenv("PSQL_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+POOL_PING_IDLE = float(os.getenv("PSQL_POOL_PING_IDLE", "30"))  # ping connections idle longer than this
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(POOL_MAX_CONN)
+
+# connection → time.monotonic() it was last handed back to the pool
+_last_released = weakref.WeakKeyDictionary()
+
+
+def _get_pool() -> psycopg2.pool.ThreadedConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = psycopg2.pool.ThreadedConnectionPool(
+                    minconn=POOL_MIN_CONN,
+                    maxconn=POOL_MAX_CONN,
+                    host=os.getenv("PSQL_HOST", "database"),
+                    port=os.getenv("PSQL_PORT", "5432"),
+                    user=os.getenv("PSQL_USER", "mqtt"),
+                    password=os.getenv("PSQL_PASS", "smartallotment2026"),
+                    database=os.getenv("PSQL_DB", "sensors")
+                )
+    return _pool
+
+
+def _checkout(pool):
+    """
+    Take a connection from the pool, pinging it with SELECT 1 only if it has sat
+    idle for POOL_PING_IDLE seconds — that's when a DB restart or idle timeout
+    could have dropped it. Dead connections are discarded and the next one is
+    checked the same way; a brand-new connection has never been released, so it
+    is pinged too, and opening one raises if the DB is unreachable.
+    """
+    while True:
+        conn = pool.getconn()
+        if time.monotonic() - _last_released.get(conn, float("-inf")) < POOL_PING_IDLE:
+            return conn
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()  # don't hand out the ping's open transaction
+            return conn
+        except psycopg2.Error:
+            pool.putconn(conn, close=True)
+
 
 def get_connection():
-    return psycopg2.connect(
-        host=os.getenv("PSQL_HOST", "database"),
-        port=os.getenv("PSQL_PORT", "5432"),
+    """
+    Check a connection out of the pool. Must be handed back with release_connection().
+    Blocks while every connection is in use and raises a 503 after POOL_TIMEOUT seconds.
+    """
+    if not _pool_slots.acquire(timeout=POOL_TIMEOUT):
+        raise HTTPException(status_code=503, detail="Database busy, try again shortly")
+    try:
+        return _checkout(_get_pool())
+    except BaseException:
+        _pool_slots.release()
+        raise
+
+
+def open_listen_connection():
+    """
+    Open a dedicated autocommit connection for LISTEN. It bypasses the pool and
+    PgBouncer (PSQL_LISTEN_HOST/PORT) — LISTEN is session state, which transaction
+    pooling doesn't keep.
+    """
+    conn = psycopg2.connect(
+        host=os.getenv("PSQL_LISTEN_HOST", os.getenv("PSQL_HOST", "database")),
+        port=os.getenv("PSQL_LISTEN_PORT", os.getenv("PSQL_PORT", "5432")),
         user=os.getenv("PSQL_USER", "mqtt"),
         password=os.getenv("PSQL_PASS", "smartallotment2026"),
         database=os.getenv("PSQL_DB", "sensors")
-    )
\ No newline at end of file
+    )
+    conn.autocommit = True
+    return conn
+
+
+def warm_pool() -> int:
+    """
+    Open and ping POOL_MIN_CONN connections so the first requests after boot
+    don't pay connection setup. Returns the number of connections warmed.
+    """
+    conns = [get_connection() for _ in range(POOL_MIN_CONN)]
+    for conn in conns:
+        release_connection(conn)
+    return len(conns)
+
+
+def release_connection(conn):
+    """Return a connection to the pool (rolls back any open transaction)"""
+    try:
+        _last_released[conn] = time.monotonic()
+        _get_pool().putconn(conn)
+    finally:
+        _pool_slots.release()
+
+
+@contextmanager
+def db_conn():
+    """Context manager — `with db_conn() as conn:` checks out and always releases a connection"""
+    conn = get_connection()
+    try:
+        yield conn
+    finally:
+        release_connection(conn)
+
+
+def get_db():
+    """FastAPI dependency — yields a pooled connection and releases it after the request"""
+    with db_conn() as conn:
+        yield conn
+
+# ----------------------------------------------------------------------------
+# Server-side prepared statements
+# ----------------------------------------------------------------------------
+# Postgres parses and plans every query from scratch unless it has been PREPAREd.
+# Like psycopg3's prepare_threshold, a statement is only prepared once it has run
+# PREPARE_THRESHOLD times on the same connection, so short-lived connections
+# don't pay an extra PREPARE round-trip for nothing.
+# Set PSQL_PREPARE_THRESHOLD=0 to disable preparing entirely — required behind
+# PgBouncer in transaction mode, where a PREPARE does not outlive its transaction.
+# ----------------------------------------------------------------------------
+
+PREPARE_THRESHOLD = int(os.getenv("PSQL_PREPARE_THRESHOLD", "5"))
+
+# connection → {statement name: use count, or True once prepared}
+_prepared_statements = weakref.WeakKeyDictionary()
+
+
+def _to_positional(sql: str) -> str:
+    """Rewrite psycopg2 %s placeholders as $1, $2, ... for PREPARE"""
+    counter = itertools.count(1)
+    parts = sql.split("%s")
+    return "".join(
+        part + (f"${next(counter)}" if i < len(parts) - 1 else "")
+        for i, part in enumerate(parts)
+    )
+
+
+def execute_prepared(cur, name: str, sql: str, params: tuple):
+    """
+    Run `sql` on `cur`, switching to a named prepared statement once it is hot.
+    `sql` uses ordinary %s placeholders and must not contain literal % signs.
+    """
+    if PREPARE_THRESHOLD <= 0:
+        cur.execute(sql, params)
+        return
+
+    statements = _prepared_statements.setdefault(cur.connection, {})
+    uses = statements.get(name, 0)
+
+    if uses is not True:
+        if uses + 1 < PREPARE_THRESHOLD:
+            statements[name] = uses + 1
+            cur.execute(sql, params)
+            return
+        cur.execute(f"PREPARE {name} AS {_to_positional(sql)}")
+        statements[name] = True
+
+    placeholders = ", ".join(["%s"] * len(params))
+    cur.execute(f"EXECUTE {name} ({placeholders})", params)
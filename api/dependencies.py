@@ -1,9 +1,11 @@
-from fastapi import Cookie, Header, HTTPException, status
-from typing import Optional, Dict, Any
+from fastapi import Cookie, Header, HTTPException, Request, status
+from typing import Optional, Dict, Any, Callable
+import threading
+import time
 import auth
 
 
-async def get_current_user(session_token: Optional[str] = Cookie(None)) -> Dict[str, Any]:
+def get_current_user(session_token: Optional[str] = Cookie(None)) -> Dict[str, Any]:
     """
     FastAPI dependency — extracts and validates the session cookie.
     Raises 401 if the cookie is missing or the session has expired.
@@ -36,7 +38,7 @@ async def get_current_user(session_token: Optional[str] = Cookie(None)) -> Dict[
     }
 
 
-async def get_optional_user(session_token: Optional[str] = Cookie(None)) -> Optional[Dict[str, Any]]:
+def get_optional_user(session_token: Optional[str] = Cookie(None)) -> Optional[Dict[str, Any]]:
     """
     FastAPI dependency — like get_current_user but returns None instead of
     raising an exception. Used on pages that redirect to /login if unauthenticated.
@@ -61,7 +63,7 @@ async def require_sys_admin(current_user: Dict = None) -> Dict[str, Any]:
     return current_user
 
 
-async def get_api_token_auth(authorization: Optional[str] = Header(None)) -> Dict[str, Any]:
+def get_api_token_auth(authorization: Optional[str] = Header(None)) -> Dict[str, Any]:
     """
     FastAPI dependency — authenticates via Bearer token in the Authorization header.
     Used by IoT devices and external API callers.
@@ -88,7 +90,7 @@ async def get_api_token_auth(authorization: Optional[str] = Header(None)) -> Dic
     return token_info
 
 
-async def get_auth_user_or_token(
+def get_auth_user_or_token(
     session_token: Optional[str] = Cookie(None),
     authorization: Optional[str] = Header(None)
 ) -> Dict[str, Any]:
@@ -126,7 +128,7 @@ async def get_auth_user_or_token(
 from fastapi import Depends
 
 
-async def require_sys_admin_dep(current_user: Dict = Depends(get_current_user)) -> Dict[str, Any]:
+def require_sys_admin_dep(current_user: Dict = Depends(get_current_user)) -> Dict[str, Any]:
     """
     Convenience dependency: validates session AND enforces sys_admin role.
     Use as: admin: Dict = Depends(require_sys_admin_dep)
@@ -136,4 +138,68 @@ async def require_sys_admin_dep(current_user: Dict = Depends(get_current_user))
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin access required"
         )
-    return current_user
\ No newline at end of file
+    return current_user
+
+
+# ------------------------------------------------------------------
+# Rate limiting
+# ------------------------------------------------------------------
+
+def client_ip_key(request: Request) -> str:
+    """Rate-limit key: the caller's IP address"""
+    return request.client.host if request.client else "unknown"
+
+
+def bearer_token_key(request: Request) -> str:
+    """
+    Rate-limit key: the SHA-256 of the caller's API token (falls back to IP if missing).
+    Hashed so the limiter never holds raw tokens in memory, and "Bearer x" and "x" share a window.
+    """
+    authorization = request.headers.get("authorization")
+    if not authorization:
+        return client_ip_key(request)
+    token = authorization[7:] if authorization.startswith("Bearer ") else authorization
+    return auth.hash_api_token(token).hex()
+
+
+class RateLimiter:
+    """
+    FastAPI dependency — fixed-window rate limiter held in process memory.
+    Allows `times` requests per `seconds` for each key returned by `key_func`,
+    and raises 429 once the window is used up.
+    Counters are not shared between processes, so with N uvicorn workers a
+    key can make up to N × `times` requests per window.
+    Use as: @router.post("/x", dependencies=[Depends(RateLimiter(5, 60, client_ip_key))])
+    """
+
+    def __init__(self, times: int, seconds: int, key_func: Callable[[Request], str] = client_ip_key):
+        self.times = times
+        self.seconds = seconds
+        self.key_func = key_func
+        self._windows: Dict[str, list] = {}  # key → [window_start, hit_count]
+        self._lock = threading.Lock()
+
+    async def __call__(self, request: Request):
+        key = self.key_func(request)
+        now = time.monotonic()
+
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.seconds:
+                # Drop stale windows now and then so the dict can't grow forever
+                if len(self._windows) > 10_000:
+                    self._windows = {
+                        k: w for k, w in self._windows.items() if now - w[0] < self.seconds
+                    }
+                window = [now, 0]
+                self._windows[key] = window
+            window[1] += 1
+            hits = window[1]
+            retry_after = int(self.seconds - (now - window[0])) + 1
+
+        if hits > self.times:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests, slow down",
+                headers={"Retry-After": str(retry_after)}
+            )
@@ -1,9 +1,20 @@
 import os
 import json
 import logging
+from functools import lru_cache
+from typing import Optional
 import paho.mqtt.client as mqtt
 from utils.logging import setup_logger
 
+# orjson encodes straight to bytes (what paho sends) several times faster than
+# stdlib json; fall back to json if the wheel isn't installed
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
 logger = setup_logger("mqtt_publisher")
 
 # Read MQTT connection settings from environment variables,
@@ -13,9 +24,22 @@ MQTT_PORT = int(os.getenv("MQTT_PORT", "1883")) # Standard MQTT port
 MQTT_USER = os.getenv("MQTT_USERNAME", "") # Empty = anonymous (broker must allow it)
 MQTT_PASS = os.getenv("MQTT_PASSWORD", "")
 
+# QoS for commands that are safe to lose and re-send (e.g. read-now).
+# Pump commands always use QoS 1 — they must arrive.
+MQTT_DEFAULT_QOS = int(os.getenv("MQTT_DEFAULT_QOS", "0"))
+PUMP_QOS = 1
+
+# Bounds on paho's outbound buffers, so a slow or unreachable broker makes
+# publishes fail visibly instead of growing the queue without limit
+MQTT_MAX_INFLIGHT = int(os.getenv("MQTT_MAX_INFLIGHT", "20"))
+MQTT_MAX_QUEUED = int(os.getenv("MQTT_MAX_QUEUED", "1000"))
+
 # Module-level persistent client — created once and reused for all publishes.
 # This avoids opening a new connection on every HTTP request.
 _client = mqtt.Client()
+_client.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
+_client.max_queued_messages_set(MQTT_MAX_QUEUED)
+_client.reconnect_delay_set(min_delay=1, max_delay=30)
 
 def connect():
     """Connect the persistent MQTT client. Called once on FastAPI startup."""
@@ -24,33 +48,59 @@ def connect():
         # some brokers reject anonymous connections if auth is required
         _client.username_pw_set(MQTT_USER, MQTT_PASS)
 
-    _client.connect(MQTT_HOST, MQTT_PORT, 60) # 60s keepalive interval
+    # connect_async() only records the target; the network thread started by
+    # loop_start() does the TCP/MQTT handshake, so API startup (on the event loop)
+    # never blocks on the broker and keeps retrying if it isn't up yet
+    _client.connect_async(MQTT_HOST, MQTT_PORT, 60) # 60s keepalive interval
     # loop_start() spins up a background thread that handles
     # reconnects and outgoing message queuing automatically
     _client.loop_start()
 
-    logger.info(f"MQTT publisher connected to {MQTT_HOST}:{MQTT_PORT}")
+    logger.info(f"MQTT publisher connecting to {MQTT_HOST}:{MQTT_PORT}")
+
+@lru_cache(maxsize=256)
+def _command_topic(device_uid: str, command: str) -> str:
+    """Topic for a device command — the same few devices and commands repeat, so it's built once"""
+    # Pump uses its own legacy topic format
+    if command == "pump":
+        # The node subscribed to pump/{uid} before the cmd/... pattern was introduced,
+        # so we keep this topic to stay compatible with the existing node code
+        return f"pump/{device_uid}"
+    return f"cmd/{device_uid}/{command}"
+
+@lru_cache(maxsize=32)
+def _bare_payload(command: str) -> bytes:
+    """Encoded payload for a command with no extra fields — identical every time"""
+    return _dumps({"command": command})
 
-def publish_command(device_uid: str, command: str, extra: dict = {}):
+def publish_command(device_uid: str, command: str, extra: Optional[dict] = None, qos: Optional[int] = None):
     """
     Publish a command to a specific device via MQTT.
 
     Topic routing:
       - pump commands  → pump/{device_uid}          (matches node's existing subscription)
       - all others     → cmd/{device_uid}/{command}  (e.g. cmd/.../read-now)
+
+    qos defaults to PUMP_QOS for pump commands and MQTT_DEFAULT_QOS otherwise.
     """
-    # Pump uses its own legacy topic format
-    if command == "pump":
-        # The node subscribed to pump/{uid} before the cmd/... pattern was introduced,
-        # so we keep this topic to stay compatible with the existing node code
-        topic = f"pump/{device_uid}"
-    else:
-        topic = f"cmd/{device_uid}/{command}"
+    topic = _command_topic(device_uid, command)
 
     # Merge the command name with any extra fields (e.g. action, seconds, requested_by)
-    # into a single JSON payload
-    payload = json.dumps({"command": command, **extra})
+    # into a single JSON payload; bare commands reuse their encoded bytes
+    payload_obj = {"command": command}
+    if extra:
+        payload_obj.update(extra)
+        payload = _dumps(payload_obj)
+    else:
+        payload = _bare_payload(command)
 
-    # QoS 1 = at-least-once delivery; the broker will retry until the node ACKs it
-    _client.publish(topic, payload, qos=1)
-    logger.info(f"Published {topic}: {payload}")
\ No newline at end of file
+    # QoS 1 = at-least-once delivery; the broker will retry until the node ACKs it.
+    # QoS 0 = fire-and-forget, no PUBACK round-trip.
+    # publish() only queues the message for the network thread — it never waits for the ACK
+    if qos is None:
+        qos = PUMP_QOS if command == "pump" else MQTT_DEFAULT_QOS
+    info = _client.publish(topic, payload, qos=qos)
+    if info.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+        logger.error("MQTT outbound queue full, dropped %s", topic)
+        raise RuntimeError("MQTT outbound queue is full, command not sent")
+    logger.info("Published %s: %s", topic, payload_obj)
\ No newline at end of file
@@ -5,11 +5,12 @@ Combines historical sensor data (soil moisture, temperature, light)
 from your TimescaleDB with Open-Meteo weather forecasts to produce:
 """
 
+import asyncio
 import httpx
 import logging
 from datetime import datetime, timezone, timedelta
 from typing import Optional
-from db import get_connection
+from db import db_conn
 
 logger = logging.getLogger("predictions")
 
@@ -81,9 +82,8 @@ def get_recent_sensor_avg(device_uid: str, sensor_type: str, hours: int = 6) ->
     Return the average sensor value for a device over the last N hours.
     Returns None if no data is found.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
+    with db_conn() as conn:
+        cur = conn.cursor()
         cur.execute("""
             SELECT AVG(sd.value)
             FROM sensor_data sd
@@ -94,8 +94,6 @@ def get_recent_sensor_avg(device_uid: str, sensor_type: str, hours: int = 6) ->
         """, (device_uid, sensor_type, hours))
         row = cur.fetchone()
         return float(row[0]) if row and row[0] is not None else None
-    finally:
-        conn.close()
 
 
 def get_sensor_trend(device_uid: str, sensor_type: str, hours: int = 24) -> Optional[str]:
@@ -103,9 +101,8 @@ def get_sensor_trend(device_uid: str, sensor_type: str, hours: int = 24) -> Opti
     Compare the last 3-hour average to the previous period and return
     'rising', 'falling', or 'stable'.
     """
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
+    with db_conn() as conn:
+        cur = conn.cursor()
         cur.execute("""
             SELECT
                 AVG(CASE WHEN sd.time > NOW() - INTERVAL '3 hours' THEN sd.value END) AS recent,
@@ -125,8 +122,6 @@ def get_sensor_trend(device_uid: str, sensor_type: str, hours: int = 24) -> Opti
         if diff < -2:
             return "falling"
         return "stable"
-    finally:
-        conn.close()
 
 
 def get_last_pump_event(device_uid: str) -> Optional[datetime]:
@@ -286,10 +281,9 @@ def predict_growth(
     whether photosynthesis conditions are favourable.
     """
     # Historical GDD from DB (last 30 days)
-    conn = get_connection()
-    cur = conn.cursor()
     historical_gdd = 0.0
-    try:
+    with db_conn() as conn:
+        cur = conn.cursor()
         cur.execute("""
             SELECT
                 date_trunc('day', sd.time) AS day,
@@ -307,8 +301,6 @@ def predict_growth(
             t_max, t_min = float(row[1]), float(row[2])
             gdd = max(0.0, ((t_max + t_min) / 2) - BASE_TEMP_GDD)
             historical_gdd += gdd
-    finally:
-        conn.close()
 
     # Forecast GDD (next 7 days)
     forecast_gdd = 0.0
@@ -377,6 +369,17 @@ def predict_growth(
 # TOP-LEVEL PREDICTION AGGREGATOR
 # ===========================================================================
 
+def _load_sensor_inputs(device_uid: str) -> tuple:
+    """Sensor readings the prediction engines need: (moisture, temperature, light, moisture trend, last pump)"""
+    return (
+        get_recent_sensor_avg(device_uid, "moisture",     hours=6),
+        get_recent_sensor_avg(device_uid, "temperature",  hours=1),
+        get_recent_sensor_avg(device_uid, "light",        hours=1),
+        get_sensor_trend(device_uid, "moisture"),
+        get_last_pump_event(device_uid),
+    )
+
+
 async def get_predictions(
     device_uid: str,
     lat: float = DEFAULT_LAT,
@@ -387,15 +390,12 @@ async def get_predictions(
     Run all prediction engines and return a combined payload.
     Called by the FastAPI endpoint.
     """
-    # --- Fetch sensor averages ---
-    moisture_pct   = get_recent_sensor_avg(device_uid, "moisture",     hours=6)
-    temperature    = get_recent_sensor_avg(device_uid, "temperature",  hours=1)
-    light_lux      = get_recent_sensor_avg(device_uid, "light",        hours=1)
-    moisture_trend = get_sensor_trend(device_uid, "moisture")
-    last_pump      = get_last_pump_event(device_uid)
-
-    # --- Fetch weather ---
-    weather = await fetch_weather_forecast(lat, lon)
+    # --- Fetch sensor averages (blocking DB work, off the event loop) and weather concurrently ---
+    sensors, weather = await asyncio.gather(
+        asyncio.to_thread(_load_sensor_inputs, device_uid),
+        fetch_weather_forecast(lat, lon),
+    )
+    moisture_pct, temperature, light_lux, moisture_trend, last_pump = sensors
 
     # Parse daily forecast into a friendlier list
     daily_keys = weather.get("daily", {})
@@ -418,7 +418,7 @@ async def get_predictions(
     # --- Run predictions ---
     watering = predict_watering(moisture_pct, moisture_trend, daily_forecast, last_pump)
     frost    = predict_frost_alerts(hourly_forecast, daily_forecast)
-    growth   = predict_growth(device_uid, daily_forecast, light_lux, planting_date)
+    growth   = await asyncio.to_thread(predict_growth, device_uid, daily_forecast, light_lux, planting_date)
 
     return {
         "generated_at":    datetime.now(timezone.utc).isoformat(),
@@ -1,15 +1,18 @@
 from fastapi import APIRouter, Request, HTTPException, status, Cookie
 from fastapi.responses import JSONResponse
 from typing import Optional, Dict
-from dependencies import get_current_user
+from dependencies import get_current_user, RateLimiter, client_ip_key
 from models import LoginRequest
 from fastapi import Depends
 import auth
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
-@router.post("/login")
-async def login(request: Request, login_data: LoginRequest):
+# Password checks are deliberately slow, so cap attempts per IP
+login_rate_limit = RateLimiter(times=5, seconds=60, key_func=client_ip_key)
+
+@router.post("/login", dependencies=[Depends(login_rate_limit)])
+def login(request: Request, login_data: LoginRequest):
     """Validate credentials and issue a session cookie"""
     user = auth.authenticate_user(login_data.username, login_data.password)
 
@@ -45,7 +48,7 @@ async def login(request: Request, login_data: LoginRequest):
     return response
 
 @router.post("/logout")
-async def logout(session_token: Optional[str] = Cookie(None)):
+def logout(session_token: Optional[str] = Cookie(None)):
     """Delete the server-side session and clear the cookie"""
     if session_token:
         auth.delete_session(session_token)
@@ -56,7 +59,7 @@ async def logout(session_token: Optional[str] = Cookie(None)):
     return response
 
 @router.get("/me")
-async def get_current_user_info(current_user: Dict = Depends(get_current_user)):
+def get_current_user_info(current_user: Dict = Depends(get_current_user)):
     """Return basic info about the currently logged-in user"""
     return {
         "username": current_user["username"],
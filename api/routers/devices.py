@@ -1,27 +1,39 @@
 from fastapi import APIRouter, HTTPException, status, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import Dict
+import itertools
+import json
 from datetime import datetime, timezone, timedelta
 from dependencies import get_auth_user_or_token, require_sys_admin_dep, get_api_token_auth as get_api_token_auth_dep
+from dependencies import RateLimiter, bearer_token_key
 from models import DeviceCreate, DeviceInfo, SensorDataSubmit, PumpCommand
-from db import get_connection
+from db import get_connection, release_connection, get_db, execute_prepared
+from utils.logging import setup_logger
 import auth
 import mqtt_publisher
 
+logger = setup_logger("devices")
+
 router = APIRouter(prefix="/api", tags=["devices"])
 
+# Rows fetched per round-trip when streaming /history from the server-side cursor
+HISTORY_BATCH_SIZE = 2000
+
+# Flood control for device uploads — keyed by the device's API token
+submit_rate_limit = RateLimiter(times=60, seconds=60, key_func=bearer_token_key)
+
 @router.get("/health")
 def health():
     """Simple liveness check — also verifies the DB connection is reachable"""
     try:
         conn = get_connection()
-        conn.close()
+        release_connection(conn)
         return {"status": "ok"}
     except Exception as e:
         return JSONResponse(status_code=500, content={"status": "error", "details": str(e)})
 
 @router.get("/node_health/{device_uid}")
-def node_health(device_uid: str, current_user: Dict = Depends(get_auth_user_or_token)):
+def node_health(device_uid: str, current_user: Dict = Depends(get_auth_user_or_token), conn=Depends(get_db)):
     """Return node health status"""
     if not auth.user_can_access_device(current_user["user_id"], device_uid):
         raise HTTPException(
@@ -30,7 +42,6 @@ def node_health(device_uid: str, current_user: Dict = Depends(get_auth_user_or_t
         )
 
     try:
-        conn = get_connection()
         cur = conn.cursor()
 
         cur.execute("SELECT last_seen FROM devices WHERE uid = %s", (device_uid,))
@@ -56,7 +67,7 @@ def node_health(device_uid: str, current_user: Dict = Depends(get_auth_user_or_t
         return JSONResponse(status_code=500, content={"status": "error", "details": str(e)})
 
 @router.get("/latest/{device_uid}")
-def get_latest(device_uid: str, current_user: Dict = Depends(get_auth_user_or_token)):
+def get_latest(device_uid: str, current_user: Dict = Depends(get_auth_user_or_token), conn=Depends(get_db)):
     """
     Return the most recent reading for each sensor type on a device.
     Results are averaged over a 30-second window around the latest timestamp.
@@ -68,10 +79,9 @@ def get_latest(device_uid: str, current_user: Dict = Depends(get_auth_user_or_to
         )
 
     try:
-        conn = get_connection()
         cur = conn.cursor()
 
-        cur.execute("""
+        execute_prepared(cur, "latest_readings", """
             WITH latest_time AS (
                 SELECT
                     sd.sensor_type,
@@ -96,7 +106,6 @@ def get_latest(device_uid: str, current_user: Dict = Depends(get_auth_user_or_to
         """, (device_uid, device_uid))
 
         rows = cur.fetchall()
-        conn.close()
 
         if not rows:
             return JSONResponse(status_code=404, content={"error": "No data found"})
@@ -119,6 +128,7 @@ def get_history(device_uid: str, hours: int = 24, current_user: Dict = Depends(g
     """
     Return all readings for a device within the last N hours (default 24).
     Bucketed by hour; ordered oldest-first for charting.
+    Rows are streamed from a server-side cursor so long ranges never sit in memory all at once.
     """
     if not auth.user_can_access_device(current_user["user_id"], device_uid):
         raise HTTPException(
@@ -126,9 +136,16 @@ def get_history(device_uid: str, hours: int = 24, current_user: Dict = Depends(g
             detail="You don't have access to this device"
         )
 
+    # Checked out by hand rather than via Depends(get_db): the response body is
+    # streamed after the handler returns, so stream_rows() releases it instead
+    conn = None
     try:
         conn = get_connection()
-        cur = conn.cursor()
+
+        # A named cursor is a server-side cursor: Postgres hands rows back
+        # in batches of `itersize` instead of sending the whole result set at once
+        cur = conn.cursor(name="hist_cur")
+        cur.itersize = HISTORY_BATCH_SIZE
 
         cur.execute("""
             SELECT
@@ -145,82 +162,99 @@ def get_history(device_uid: str, hours: int = 24, current_user: Dict = Depends(g
             ORDER BY time_bucket ASC;
         """, (device_uid, hours))
 
-        raw_rows = cur.fetchall()
-        conn.close()
-
-        rows = []
-        for row in raw_rows:
-            rows.append({
-                "sensor_name": row[1],
-                "timestamp": row[2],
-                "sensor_value": row[3],
-                "sensor_type": row[1],
-                "unit": row[4]
-            })
-
-        return rows
+        # A named cursor only runs the query on its first fetch, so pull the first
+        # batch here — planning and early execution errors still become a 500
+        # instead of a 200 with a half-written body
+        first_rows = cur.fetchmany(HISTORY_BATCH_SIZE)
 
     except Exception as e:
+        if conn:
+            release_connection(conn)
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+    def stream_rows():
+        # Emit a plain JSON array one row at a time so the dashboard can keep
+        # calling res.json() exactly as before
+        try:
+            yield "["
+            first = True
+            try:
+                for row in itertools.chain(first_rows, cur):
+                    item = json.dumps({
+                        "sensor_name": row[1],
+                        "timestamp": row[2].isoformat() if row[2] else None,
+                        "sensor_value": row[3],
+                        "sensor_type": row[1],
+                        "unit": row[4]
+                    })
+                    yield item if first else "," + item
+                    first = False
+            except Exception as e:
+                # The 200 has already gone out; close the array so the body is still
+                # valid JSON, and log the failure since the client can't see it
+                logger.error("History stream for %s failed mid-response: %s", device_uid, e)
+            yield "]"
+        finally:
+            try:
+                cur.close()
+            finally:
+                release_connection(conn)
+
+    # Start the generator here so its finally block (which hands the connection
+    # back to the pool) still runs if the client disconnects before streaming begins
+    body = stream_rows()
+    opening = next(body)
+
+    return StreamingResponse(itertools.chain([opening], body), media_type="application/json")
+
 @router.get("/devices")
-def list_devices(current_user: Dict = Depends(get_auth_user_or_token)):
+def list_devices(current_user: Dict = Depends(get_auth_user_or_token), conn=Depends(get_db)):
     """
     List devices the current user can access.
     sys_admin sees all; regular users only see devices on their assigned sites.
     """
-    conn = None
     try:
-        conn = get_connection()
         cur = conn.cursor()
 
-        allowed_sites = auth.get_user_site_access(current_user["user_id"])
-
-        if not allowed_sites:
+        if current_user.get("role") == "sys_admin":
             cur.execute("SELECT DISTINCT uid, name, site_id FROM devices WHERE uid IS NOT NULL ORDER BY uid;")
         else:
-            placeholders = ','.join(['%s'] * len(allowed_sites))
-            cur.execute(f"""
+            # Filter in SQL against the cached site list; no sites means no devices
+            allowed_sites = auth.get_user_site_access(current_user["user_id"])
+            cur.execute("""
                 SELECT DISTINCT uid, name, site_id
                 FROM devices
-                WHERE uid IS NOT NULL AND site_id IN ({placeholders})
+                WHERE uid IS NOT NULL AND site_id = ANY(%s)
                 ORDER BY uid;
-            """, allowed_sites)
+            """, (allowed_sites,))
 
         rows = cur.fetchall()
         devices = [{"uid": row[0], "name": row[1], "site_id": row[2]} for row in rows]
 
-        conn.close()
         return {"devices": devices}
 
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-    finally:
-        if conn:
-            conn.close()
-
 @router.post("/device/register", response_model=DeviceInfo)
-def register_device(device: DeviceCreate, admin: Dict = Depends(require_sys_admin_dep)):
+def register_device(device: DeviceCreate, admin: Dict = Depends(require_sys_admin_dep), conn=Depends(get_db)):
     """Register a new device — sys_admin only. Device starts inactive until it sends data."""
-    conn = get_connection()
     cur = conn.cursor()
 
-    cur.execute("SELECT uid, name, active, last_seen, site_id FROM devices WHERE uid = %s;", (device.uid,))
-    row = cur.fetchone()
-    if row:
-        conn.close()
-        raise HTTPException(status_code=400, detail="Device already registered")
-
     cur.execute("""
         INSERT INTO devices (uid, name, site_id, active)
         VALUES (%s, %s, %s, FALSE)
+        ON CONFLICT (uid) DO NOTHING
         RETURNING uid, name, active, last_seen, site_id;
     """, (device.uid, device.name, device.site_id))
 
     new_device = cur.fetchone()
     conn.commit()
-    conn.close()
+
+    # No row back means the uid was already taken
+    if not new_device:
+        raise HTTPException(status_code=400, detail="Device already registered")
+    auth.invalidate_device_site(device.uid)
 
     return {
         "uid": new_device[0],
@@ -230,10 +264,11 @@ def register_device(device: DeviceCreate, admin: Dict = Depends(require_sys_admi
         "site_id": new_device[4],
     }
 
-@router.post("/data/submit")
-async def submit_sensor_data(
+@router.post("/data/submit", dependencies=[Depends(submit_rate_limit)])
+def submit_sensor_data(
     data: SensorDataSubmit,
     token_info: Dict = Depends(get_api_token_auth_dep),
+    conn=Depends(get_db),
 ):
     """
     Submit sensor data — device API token only.
@@ -252,15 +287,12 @@ async def submit_sensor_data(
     if not device_site_id:
         raise HTTPException(status_code=400, detail="Device must be assigned to a site")
 
-    conn = None
     try:
-        conn = get_connection()
         cur = conn.cursor()
 
-        cur.execute("SELECT id FROM devices WHERE uid = %s;", (device_uid,))
+        execute_prepared(cur, "device_id_by_uid", "SELECT id FROM devices WHERE uid = %s;", (device_uid,))
         row = cur.fetchone()
         if not row:
-            conn.close()
             raise HTTPException(status_code=404, detail="Device not found")
 
         device_id = row[0]
@@ -278,7 +310,6 @@ async def submit_sensor_data(
         """, (device_id,))
 
         conn.commit()
-        conn.close()
 
         return {
             "message": "Data submitted successfully",
@@ -288,12 +319,10 @@ async def submit_sensor_data(
     except HTTPException:
         raise
     except Exception as e:
-        if conn:
-            conn.close()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/devices/{device_uid}/read-now")
-async def trigger_manual_reading(device_uid: str, current_user: Dict = Depends(get_auth_user_or_token)):
+def trigger_manual_reading(device_uid: str, current_user: Dict = Depends(get_auth_user_or_token)):
     """Send an MQTT command to trigger an immediate sensor reading on the device."""
     if not auth.user_can_access_device(current_user["user_id"], device_uid):
         raise HTTPException(status_code=403, detail="Access denied")
@@ -308,7 +337,7 @@ async def trigger_manual_reading(device_uid: str, current_user: Dict = Depends(g
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/devices/{device_uid}/pump")
-async def trigger_pump(device_uid: str, command: PumpCommand, current_user: Dict = Depends(get_auth_user_or_token)):
+def trigger_pump(device_uid: str, command: PumpCommand, current_user: Dict = Depends(get_auth_user_or_token)):
     """
     Send an MQTT pump command to a device — sys_admin only.
     Actions: 'on', 'off', 'run' (on for N seconds then auto-off).
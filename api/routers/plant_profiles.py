@@ -2,7 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from typing import Dict
 from dependencies import get_current_user
 from models import PlantProfileCreate, PlantProfileUpdate, PlantTypeCreate, PlantTypeUpdate, VarietyCreate, VarietyUpdate
-from db import get_connection
+from db import get_db
 
 router = APIRouter(prefix="/api/plant-profiles", tags=["plant_profiles"])
 
@@ -11,48 +11,43 @@ router = APIRouter(prefix="/api/plant-profiles", tags=["plant_profiles"])
 # ============================================================
 
 @router.get("/types")
-async def list_plant_types(current_user: Dict = Depends(get_current_user)):
+def list_plant_types(current_user: Dict = Depends(get_current_user), conn=Depends(get_db)):
     """
     Return all plant types with variety count and sensor assignments.
     """
-    conn = get_connection()
     cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT
-                pt.id,
-                pt.name,
-                pt.description,
-                COALESCE(pt.emoji, '🌱') AS emoji,
-                COUNT(DISTINCT pv.id)::int AS variety_count,
-                COUNT(DISTINCT spa.sensor_id)::int AS sensor_count
-            FROM plant_types pt
-            LEFT JOIN plant_varieties pv ON pv.plant_type_id = pt.id
-            LEFT JOIN sensor_plant_assignments spa ON spa.variety_id = pv.id
-            GROUP BY pt.id, pt.name, pt.description, pt.emoji
-            ORDER BY pt.name;
-        """)
-        rows = cur.fetchall()
-        return {
-            "plant_types": [
-                {
-                    "id": r[0],
-                    "name": r[1],
-                    "description": r[2],
-                    "emoji": r[3],
-                    "variety_count": r[4],
-                    "sensor_count": r[5],
-                }
-                for r in rows
-            ]
-        }
-    finally:
-        conn.close()
+    cur.execute("""
+        SELECT
+            pt.id,
+            pt.name,
+            pt.description,
+            COALESCE(pt.emoji, '🌱') AS emoji,
+            COUNT(DISTINCT pv.id)::int AS variety_count,
+            COUNT(DISTINCT spa.sensor_id)::int AS sensor_count
+        FROM plant_types pt
+        LEFT JOIN plant_varieties pv ON pv.plant_type_id = pt.id
+        LEFT JOIN sensor_plant_assignments spa ON spa.variety_id = pv.id
+        GROUP BY pt.id, pt.name, pt.description, pt.emoji
+        ORDER BY pt.name;
+    """)
+    rows = cur.fetchall()
+    return {
+        "plant_types": [
+            {
+                "id": r[0],
+                "name": r[1],
+                "description": r[2],
+                "emoji": r[3],
+                "variety_count": r[4],
+                "sensor_count": r[5],
+            }
+            for r in rows
+        ]
+    }
  
 @router.post("/types")
-async def create_plant_type(body: PlantTypeCreate, current_user: Dict = Depends(get_current_user)):
+def create_plant_type(body: PlantTypeCreate, current_user: Dict = Depends(get_current_user), conn=Depends(get_db)):
     """Create a new plant type."""
-    conn = get_connection()
     cur = conn.cursor()
     try:
         cur.execute("SELECT id FROM plant_types WHERE name = %s;", (body.name,))
@@ -82,17 +77,15 @@ async def create_plant_type(body: PlantTypeCreate, current_user: Dict = Depends(
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
  
 @router.put("/types/{plant_type_id}")
-async def update_plant_type(
+def update_plant_type(
     plant_type_id: int,
     body: PlantTypeUpdate,
-    current_user: Dict = Depends(get_current_user)
+    current_user: Dict = Depends(get_current_user),
+    conn=Depends(get_db),
 ):
     """Update a plant type."""
-    conn = get_connection()
     cur = conn.cursor()
     try:
         cur.execute("SELECT id FROM plant_types WHERE id = %s;", (plant_type_id,))
@@ -130,16 +123,13 @@ async def update_plant_type(
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
  
 @router.delete("/types/{plant_type_id}")
-async def delete_plant_type(plant_type_id: int, current_user: Dict = Depends(get_current_user)):
+def delete_plant_type(plant_type_id: int, current_user: Dict = Depends(get_current_user), conn=Depends(get_db)):
     """
     Delete a plant type and all its varieties.
     Sensor assignments are cleaned up via cascade.
     """
-    conn = get_connection()
     cur = conn.cursor()
     try:
         cur.execute("SELECT name FROM plant_types WHERE id = %s;", (plant_type_id,))
@@ -157,78 +147,72 @@ async def delete_plant_type(plant_type_id: int, current_user: Dict = Depends(get
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
  
 # ============================================================
 # VARIETIES ENDPOINTS
 # ============================================================
 @router.get("/types/{plant_type_id}/varieties")
-async def list_varieties(plant_type_id: int, current_user: Dict = Depends(get_current_user)):
+def list_varieties(plant_type_id: int, current_user: Dict = Depends(get_current_user), conn=Depends(get_db)):
     """
     Return all varieties for a plant type with sensor assignment counts.
     """
-    conn = get_connection()
     cur = conn.cursor()
-    try:
-        # First verify plant type exists
-        cur.execute("SELECT id FROM plant_types WHERE id = %s;", (plant_type_id,))
-        if not cur.fetchone():
-            raise HTTPException(status_code=404, detail="Plant type not found")
+    # First verify plant type exists
+    cur.execute("SELECT id FROM plant_types WHERE id = %s;", (plant_type_id,))
+    if not cur.fetchone():
+        raise HTTPException(status_code=404, detail="Plant type not found")
  
-        cur.execute("""
-            SELECT
-                pv.id,
-                pv.name,
-                pv.description,
-                pv.sow_type,
-                pv.moisture_min,
-                pv.moisture_max,
-                COALESCE(pv.light_min, 0)::float AS light_min,
-                COALESCE(pv.light_max, 0)::float AS light_max,
-                COALESCE(pv.temp_min, 0)::float AS temp_min,
-                COALESCE(pv.temp_max, 0)::float AS temp_max,
-                COUNT(spa.sensor_id)::int AS sensor_count
-            FROM plant_varieties pv
-            LEFT JOIN sensor_plant_assignments spa ON spa.variety_id = pv.id
-            WHERE pv.plant_type_id = %s
-            GROUP BY pv.id, pv.name, pv.description, pv.moisture_min,
-                     pv.moisture_max, pv.light_min, pv.light_max,
-                     pv.temp_min, pv.temp_max
-            ORDER BY pv.name;
-        """, (plant_type_id,))
+    cur.execute("""
+        SELECT
+            pv.id,
+            pv.name,
+            pv.description,
+            pv.sow_type,
+            pv.moisture_min,
+            pv.moisture_max,
+            COALESCE(pv.light_min, 0)::float AS light_min,
+            COALESCE(pv.light_max, 0)::float AS light_max,
+            COALESCE(pv.temp_min, 0)::float AS temp_min,
+            COALESCE(pv.temp_max, 0)::float AS temp_max,
+            COUNT(spa.sensor_id)::int AS sensor_count
+        FROM plant_varieties pv
+        LEFT JOIN sensor_plant_assignments spa ON spa.variety_id = pv.id
+        WHERE pv.plant_type_id = %s
+        GROUP BY pv.id, pv.name, pv.description, pv.moisture_min,
+                 pv.moisture_max, pv.light_min, pv.light_max,
+                 pv.temp_min, pv.temp_max
+        ORDER BY pv.name;
+    """, (plant_type_id,))
  
-        rows = cur.fetchall()
-        return {
-            "plant_type_id": plant_type_id,
-            "varieties": [
-                {
-                    "id": r[0],
-                    "name": r[1],
-                    "description": r[2],
-                    "sow_type":r[3],
-                    "moisture_min": float(r[4]),
-                    "moisture_max": float(r[5]),
-                    "light_min": r[6] if r[6] else None,
-                    "light_max": r[7] if r[7] else None,
-                    "temp_min": r[8] if r[8] else None,
-                    "temp_max": r[9] if r[9] else None,
-                    "sensor_count": r[10],
-                }
-                for r in rows
-            ]
-        }
-    finally:
-        conn.close()
+    rows = cur.fetchall()
+    return {
+        "plant_type_id": plant_type_id,
+        "varieties": [
+            {
+                "id": r[0],
+                "name": r[1],
+                "description": r[2],
+                "sow_type":r[3],
+                "moisture_min": float(r[4]),
+                "moisture_max": float(r[5]),
+                "light_min": r[6] if r[6] else None,
+                "light_max": r[7] if r[7] else None,
+                "temp_min": r[8] if r[8] else None,
+                "temp_max": r[9] if r[9] else None,
+                "sensor_count": r[10],
+            }
+            for r in rows
+        ]
+    }
  
 @router.post("/types/{plant_type_id}/varieties")
-async def create_variety(
+def create_variety(
     plant_type_id: int,
     body: VarietyCreate,
-    current_user: Dict = Depends(get_current_user)
+    current_user: Dict = Depends(get_current_user),
+    conn=Depends(get_db),
 ):
     """Create a new variety for a plant type."""
-    conn = get_connection()
     cur = conn.cursor()
     try:
         if body.moisture_min >= body.moisture_max:
@@ -278,17 +262,15 @@ async def create_variety(
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
  
 @router.put("/varieties/{variety_id}")
-async def update_variety(
+def update_variety(
     variety_id: int,
     body: VarietyUpdate,
-    current_user: Dict = Depends(get_current_user)
+    current_user: Dict = Depends(get_current_user),
+    conn=Depends(get_db),
 ):
     """Update a variety."""
-    conn = get_connection()
     cur = conn.cursor()
     try:
         if body.moisture_min >= body.moisture_max:
@@ -336,16 +318,13 @@ async def update_variety(
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
  
 @router.delete("/varieties/{variety_id}")
-async def delete_variety(variety_id: int, current_user: Dict = Depends(get_current_user)):
+def delete_variety(variety_id: int, current_user: Dict = Depends(get_current_user), conn=Depends(get_db)):
     """
     Delete a variety.
     Sensor assignments are cleaned up via cascade.
     """
-    conn = get_connection()
     cur = conn.cursor()
     try:
         cur.execute("SELECT name FROM plant_varieties WHERE id = %s;", (variety_id,))
@@ -362,51 +341,45 @@ async def delete_variety(variety_id: int, current_user: Dict = Depends(get_curre
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
  
 # ============================================================
 # LEGACY ENDPOINTS (for backward compatibility)
 # ============================================================
 @router.get("")
-async def list_plant_profiles(current_user: Dict = Depends(get_current_user)):
+def list_plant_profiles(current_user: Dict = Depends(get_current_user), conn=Depends(get_db)):
     """
     Return a flattened list of all varieties (for backward compatibility with sensors UI).
     Each variety is returned as if it were a profile.
     """
-    conn = get_connection()
     cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT
-                pv.id,
-                pt.name || ' - ' || pv.name AS full_name,
-                pv.moisture_min,
-                pv.moisture_max,
-                pv.description,
-                pt.emoji,
-                COUNT(spa.sensor_id)::int AS sensor_count
-            FROM plant_varieties pv
-            JOIN plant_types pt ON pt.id = pv.plant_type_id
-            LEFT JOIN sensor_plant_assignments spa ON spa.variety_id = pv.id
-            GROUP BY pv.id, pt.name, pv.name, pv.moisture_min, pv.moisture_max,
-                     pv.description, pt.emoji
-            ORDER BY pt.name, pv.name;
-        """)
-        rows = cur.fetchall()
-        return {
-            "plant_profiles": [
-                {
-                    "id": r[0],
-                    "name": r[1],
-                    "moisture_min": float(r[2]),
-                    "moisture_max": float(r[3]),
-                    "description": r[4],
-                    "emoji": r[5],
-                    "sensor_count": r[6],
-                }
-                for r in rows
-            ]
-        }
-    finally:
-        conn.close()
\ No newline at end of file
+    cur.execute("""
+        SELECT
+            pv.id,
+            pt.name || ' - ' || pv.name AS full_name,
+            pv.moisture_min,
+            pv.moisture_max,
+            pv.description,
+            pt.emoji,
+            COUNT(spa.sensor_id)::int AS sensor_count
+        FROM plant_varieties pv
+        JOIN plant_types pt ON pt.id = pv.plant_type_id
+        LEFT JOIN sensor_plant_assignments spa ON spa.variety_id = pv.id
+        GROUP BY pv.id, pt.name, pv.name, pv.moisture_min, pv.moisture_max,
+                 pv.description, pt.emoji
+        ORDER BY pt.name, pv.name;
+    """)
+    rows = cur.fetchall()
+    return {
+        "plant_profiles": [
+            {
+                "id": r[0],
+                "name": r[1],
+                "moisture_min": float(r[2]),
+                "moisture_max": float(r[3]),
+                "description": r[4],
+                "emoji": r[5],
+                "sensor_count": r[6],
+            }
+            for r in rows
+        ]
+    }
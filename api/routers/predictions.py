@@ -1,3 +1,5 @@
+import asyncio
+
 from fastapi import APIRouter, HTTPException, Depends
 from typing import Dict
 from dependencies import get_auth_user_or_token
@@ -23,7 +25,7 @@ async def device_predictions(
       lon           — longitude of the allotment (defaults to config value)
       planting_date — optional ISO date string (YYYY-MM-DD) for GDD tracking
     """
-    if not auth.user_can_access_device(current_user["user_id"], device_uid):
+    if not await asyncio.to_thread(auth.user_can_access_device, current_user["user_id"], device_uid):
         raise HTTPException(status_code=403, detail="Access denied")
 
     try:
@@ -1,64 +1,79 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import Dict
+from fastapi import APIRouter, HTTPException, Depends, Query
+from typing import Dict, Optional
+import base64
+import json
 from dependencies import get_current_user
 from models import SensorRegister, SensorPlantAssign, SensorZoneAssign
-from db import get_connection
+from db import get_db
 import auth
 
 router = APIRouter(prefix="/api/sensors", tags=["sensors"])
 
+def _encode_cursor(device_uid: str, sensor_name: str) -> str:
+    """Opaque page cursor — base64 JSON, so uids and names may contain any character"""
+    return base64.urlsafe_b64encode(json.dumps([device_uid, sensor_name]).encode()).decode()
+
+def _decode_cursor(after: str) -> tuple:
+    """Inverse of _encode_cursor; raises 400 for anything it didn't produce"""
+    try:
+        device_uid, sensor_name = json.loads(base64.urlsafe_b64decode(after.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid 'after' cursor")
+    if not isinstance(device_uid, str) or not isinstance(sensor_name, str):
+        raise HTTPException(status_code=400, detail="Invalid 'after' cursor")
+    return device_uid, sensor_name
+
 @router.get("/list")
-async def list_sensors_managed(current_user: Dict = Depends(get_current_user)):
+def list_sensors_managed(
+    limit: int = Query(200, ge=1, le=1000),
+    after: Optional[str] = None,
+    current_user: Dict = Depends(get_current_user),
+    conn=Depends(get_db),
+):
     """
     List sensors — sys_admin sees all, regular users see only their sites' sensors.
     Includes plant_profile_id and plant_profile_name for the frontend badge.
+    Paged by keyset: pass the previous page's opaque `next_after` cursor
+    as `after` until it comes back null.
     """
-    conn = get_connection()
+    # Rejected before the try below, which would turn the 400 into a 500
+    keyset_after = _decode_cursor(after) if after else None
+
     cur = conn.cursor()
 
     try:
-        allowed_sites = auth.get_user_site_access(current_user["user_id"])
-
-        if not allowed_sites:
-            cur.execute("""
-                SELECT
-                    s.id, s.device_id, d.uid AS device_uid, s.sensor_name,
-                    s.sensor_type, s.unit, s.active, s.last_value, s.last_seen,
-                    s.notes, s.created_at, s.zone_name,
-                    spa.variety_id,
-                    COALESCE(pt.name || ' - ' || pv.name, 'Not Assigned') AS plant_profile_name,
-                    pt.emoji,
-                    pv.moisture_min, pv.moisture_max,
-                    pv.light_min, pv.light_max,
-                    pv.temp_min, pv.temp_max
-                FROM sensors s
-                JOIN devices d ON s.device_id = d.id
-                LEFT JOIN sensor_plant_assignments spa ON spa.sensor_id = s.id
-                LEFT JOIN plant_varieties pv ON pv.id = spa.variety_id
-                LEFT JOIN plant_types pt ON pt.id = pv.plant_type_id
-                ORDER BY d.uid, s.sensor_name;
-            """)
+        # The role comes from the session, and regular users are filtered by joining
+        # their site assignments — one query either way, and the join can use the
+        # user_site_assignments index instead of an OR across two subqueries
+        if current_user.get("role") == "sys_admin":
+            access_join, params = "", []
         else:
-            placeholders = ','.join(['%s'] * len(allowed_sites))
-            cur.execute(f"""
-                SELECT
-                    s.id, s.device_id, d.uid AS device_uid, s.sensor_name,
-                    s.sensor_type, s.unit, s.active, s.last_value, s.last_seen,
-                    s.notes, s.created_at, s.zone_name,
-                    spa.variety_id,
-                    COALESCE(pt.name || ' - ' || pv.name, 'Not Assigned') AS plant_profile_name,
-                    pt.emoji,
-                    pv.moisture_min, pv.moisture_max,
-                    pv.light_min, pv.light_max,
-                    pv.temp_min, pv.temp_max
-                FROM sensors s
-                JOIN devices d ON s.device_id = d.id
-                LEFT JOIN sensor_plant_assignments spa ON spa.sensor_id = s.id
-                LEFT JOIN plant_varieties pv ON pv.id = spa.variety_id
-                LEFT JOIN plant_types pt ON pt.id = pv.plant_type_id        
-                WHERE d.site_id IN ({placeholders})
-                ORDER BY d.uid, s.sensor_name;
-            """, allowed_sites)
+            access_join = "JOIN user_site_assignments a ON a.site_id = d.site_id AND a.user_id = %s"
+            params = [current_user["user_id"]]
+
+        # (uid, sensor_name) is unique, so it doubles as the page cursor
+        keyset = ""
+        if keyset_after:
+            keyset = "WHERE (d.uid, s.sensor_name) > (%s, %s)"
+            params += list(keyset_after)
+
+        cur.execute(f"""
+            SELECT
+                s.id, s.device_id, d.uid AS device_uid, s.sensor_name,
+                s.sensor_type, s.unit, s.active, s.last_value, s.last_seen,
+                s.notes, s.created_at, s.zone_name,
+                spa.variety_id,
+                COALESCE(pt.name || ' - ' || pv.name, 'Not Assigned') AS plant_profile_name
+            FROM sensors s
+            JOIN devices d ON s.device_id = d.id
+            {access_join}
+            LEFT JOIN sensor_plant_assignments spa ON spa.sensor_id = s.id
+            LEFT JOIN plant_varieties pv ON pv.id = spa.variety_id
+            LEFT JOIN plant_types pt ON pt.id = pv.plant_type_id
+            {keyset}
+            ORDER BY d.uid, s.sensor_name
+            LIMIT %s;
+        """, params + [limit])
 
         rows = cur.fetchall()
 
@@ -82,47 +97,23 @@ async def list_sensors_managed(current_user: Dict = Depends(get_current_user)):
             })
 
         cur.close()
-        conn.close()
 
-        return {"sensors": sensors}
+        # A full page means there may be more; hand back where to resume
+        next_after = None
+        if len(rows) == limit:
+            next_after = _encode_cursor(rows[-1][2], rows[-1][3])
+
+        return {"sensors": sensors, "next_after": next_after}
 
     except Exception as e:
-        if conn:
-            conn.close()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/register")
-async def register_sensor(sensor_data: SensorRegister, current_user: Dict = Depends(get_current_user)):
+def register_sensor(sensor_data: SensorRegister, current_user: Dict = Depends(get_current_user), conn=Depends(get_db)):
     """Register a new sensor against a device the user has access to"""
-    conn = get_connection()
     cur = conn.cursor()
 
     try:
-        cur.execute("SELECT id, site_id FROM devices WHERE uid = %s;", (sensor_data.device_uid,))
-        device_row = cur.fetchone()
-
-        if not device_row:
-            conn.close()
-            raise HTTPException(status_code=404, detail="Device not found")
-
-        device_id, site_id = device_row
-
-        if not auth.user_can_access_device(current_user["user_id"], sensor_data.device_uid):
-            conn.close()
-            raise HTTPException(status_code=403, detail="You don't have access to this device")
-
-        cur.execute("""
-            SELECT id FROM sensors
-            WHERE device_id = %s AND sensor_name = %s;
-        """, (device_id, sensor_data.sensor_name))
-
-        if cur.fetchone():
-            conn.close()
-            raise HTTPException(
-                status_code=400,
-                detail=f"Sensor '{sensor_data.sensor_name}' already exists for this device"
-            )
-
         unit = sensor_data.unit
         if not unit:
             unit_map = {
@@ -132,15 +123,42 @@ async def register_sensor(sensor_data: SensorRegister, current_user: Dict = Depe
             }
             unit = unit_map.get(sensor_data.sensor_type, '')
 
+        # Device lookup, access check, duplicate check and insert in one statement.
+        # The two flags say which step stopped it when nothing was inserted;
+        # uq_device_sensor turns a duplicate into an empty insert.
         cur.execute("""
-            INSERT INTO sensors (
-                device_id, sensor_name, sensor_type, unit,
-                active, notes, zone_name, created_at, registered_by
+            WITH dev AS (
+                SELECT id, site_id FROM devices WHERE uid = %s
+            ),
+            allowed AS (
+                SELECT dev.id
+                FROM dev
+                JOIN users u ON u.id = %s
+                WHERE u.role = 'sys_admin'
+                   OR EXISTS (
+                       SELECT 1 FROM user_site_assignments a
+                       WHERE a.user_id = u.id AND a.site_id = dev.site_id
+                   )
+            ),
+            ins AS (
+                INSERT INTO sensors (
+                    device_id, sensor_name, sensor_type, unit,
+                    active, notes, zone_name, created_at, registered_by
+                )
+                SELECT allowed.id, %s, %s, %s, TRUE, %s, %s, NOW(), %s
+                FROM allowed
+                ON CONFLICT (device_id, sensor_name) DO NOTHING
+                RETURNING id, sensor_name, sensor_type, unit, active, created_at
             )
-            VALUES (%s, %s, %s, %s, TRUE, %s, %s, NOW(), %s)
-            RETURNING id, sensor_name, sensor_type, unit, active, created_at;
+            SELECT
+                EXISTS (SELECT 1 FROM dev),
+                EXISTS (SELECT 1 FROM allowed),
+                ins.id, ins.sensor_name, ins.sensor_type, ins.unit, ins.active, ins.created_at
+            FROM (SELECT 1) AS one
+            LEFT JOIN ins ON TRUE;
         """, (
-            device_id,
+            sensor_data.device_uid,
+            current_user["user_id"],
             sensor_data.sensor_name,
             sensor_data.sensor_type,
             unit,
@@ -149,9 +167,18 @@ async def register_sensor(sensor_data: SensorRegister, current_user: Dict = Depe
             current_user["user_id"]
         ))
 
-        new_sensor = cur.fetchone()
+        device_found, allowed, *new_sensor = cur.fetchone()
         conn.commit()
-        conn.close()
+
+        if not device_found:
+            raise HTTPException(status_code=404, detail="Device not found")
+        if not allowed:
+            raise HTTPException(status_code=403, detail="You don't have access to this device")
+        if new_sensor[0] is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Sensor '{sensor_data.sensor_name}' already exists for this device"
+            )
 
         return {
             "message": "Sensor registered successfully",
@@ -166,18 +193,13 @@ async def register_sensor(sensor_data: SensorRegister, current_user: Dict = Depe
         }
 
     except HTTPException:
-        if conn:
-            conn.close()
         raise
     except Exception as e:
-        if conn:
-            conn.close()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/{sensor_id}/activate")
-async def activate_sensor(sensor_id: int, current_user: Dict = Depends(get_current_user)):
+def activate_sensor(sensor_id: int, current_user: Dict = Depends(get_current_user), conn=Depends(get_db)):
     """Mark a sensor as active so it appears in dashboards"""
-    conn = get_connection()
     cur = conn.cursor()
 
     try:
@@ -191,32 +213,24 @@ async def activate_sensor(sensor_id: int, current_user: Dict = Depends(get_curre
         sensor = cur.fetchone()
 
         if not sensor:
-            conn.close()
             raise HTTPException(status_code=404, detail="Sensor not found")
 
         if not auth.user_can_access_device(current_user["user_id"], sensor[1]):
-            conn.close()
             raise HTTPException(status_code=403, detail="Access denied")
 
         cur.execute("UPDATE sensors SET active = TRUE WHERE id = %s;", (sensor_id,))
         conn.commit()
-        conn.close()
 
         return {"message": "Sensor activated successfully"}
 
     except HTTPException:
-        if conn:
-            conn.close()
         raise
     except Exception as e:
-        if conn:
-            conn.close()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/{sensor_id}/deactivate")
-async def deactivate_sensor(sensor_id: int, current_user: Dict = Depends(get_current_user)):
+def deactivate_sensor(sensor_id: int, current_user: Dict = Depends(get_current_user), conn=Depends(get_db)):
     """Mark a sensor as inactive (hides it from dashboards without deleting data)"""
-    conn = get_connection()
     cur = conn.cursor()
 
     try:
@@ -230,32 +244,24 @@ async def deactivate_sensor(sensor_id: int, current_user: Dict = Depends(get_cur
         sensor = cur.fetchone()
 
         if not sensor:
-            conn.close()
             raise HTTPException(status_code=404, detail="Sensor not found")
 
         if not auth.user_can_access_device(current_user["user_id"], sensor[1]):
-            conn.close()
             raise HTTPException(status_code=403, detail="Access denied")
 
         cur.execute("UPDATE sensors SET active = FALSE WHERE id = %s;", (sensor_id,))
         conn.commit()
-        conn.close()
 
         return {"message": "Sensor deactivated successfully"}
 
     except HTTPException:
-        if conn:
-            conn.close()
         raise
     except Exception as e:
-        if conn:
-            conn.close()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/{sensor_id}/delete")
-async def delete_sensor(sensor_id: int, current_user: Dict = Depends(get_current_user)):
+def delete_sensor(sensor_id: int, current_user: Dict = Depends(get_current_user), conn=Depends(get_db)):
     """Permanently delete a sensor record — does NOT delete historical sensor_data rows"""
-    conn = get_connection()
     cur = conn.cursor()
 
     try:
@@ -269,26 +275,19 @@ async def delete_sensor(sensor_id: int, current_user: Dict = Depends(get_current
         sensor = cur.fetchone()
 
         if not sensor:
-            conn.close()
             raise HTTPException(status_code=404, detail="Sensor not found")
 
         if not auth.user_can_access_device(current_user["user_id"], sensor[2]):
-            conn.close()
             raise HTTPException(status_code=403, detail="Access denied")
 
         cur.execute("DELETE FROM sensors WHERE id = %s;", (sensor_id,))
         conn.commit()
-        conn.close()
 
         return {"message": f"Sensor '{sensor[1]}' deleted successfully"}
 
     except HTTPException:
-        if conn:
-            conn.close()
         raise
     except Exception as e:
-        if conn:
-            conn.close()
         raise HTTPException(status_code=500, detail=str(e))
 
 # ---------------------------------------------------------
@@ -296,13 +295,13 @@ async def delete_sensor(sensor_id: int, current_user: Dict = Depends(get_current
 # ---------------------------------------------------------
 
 @router.put("/{sensor_id}/plant-profile")
-async def assign_plant_profile(
+def assign_plant_profile(
     sensor_id: int,
     body: SensorPlantAssign,
-    current_user: Dict = Depends(get_current_user)
+    current_user: Dict = Depends(get_current_user),
+    conn=Depends(get_db),
 ):
     """Assign a plant variety to a moisture sensor"""
-    conn = get_connection()
     cur = conn.cursor()
     try:
         # Check sensor exists and get device
@@ -343,13 +342,10 @@ async def assign_plant_profile(
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @router.delete("/{sensor_id}/plant-profile")
-async def remove_plant_profile(sensor_id: int, current_user: Dict = Depends(get_current_user)):
+def remove_plant_profile(sensor_id: int, current_user: Dict = Depends(get_current_user), conn=Depends(get_db)):
     """Remove plant variety from a sensor (reverts to General default)"""
-    conn = get_connection()
     cur = conn.cursor()
     try:
         # Check sensor and access
@@ -373,164 +369,152 @@ async def remove_plant_profile(sensor_id: int, current_user: Dict = Depends(get_
     except Exception as e:
         conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        conn.close()
 
 @router.get("/{sensor_id}/moisture-status")
-async def sensor_moisture_status(sensor_id: int, current_user: Dict = Depends(get_current_user)):
+def sensor_moisture_status(sensor_id: int, current_user: Dict = Depends(get_current_user), conn=Depends(get_db)):
     """
     Return current moisture reading + whether it's ok/too_dry/too_wet
     based on the assigned plant variety (falls back to General).
     Also returns light and temperature constraints if available.
     """
-    conn = get_connection()
     cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT s.last_value, s.unit, d.uid,
-                   pt.emoji,
-                   COALESCE(pt.name || ' - ' || pv.name, gp.name) AS profile_name,
-                   COALESCE(pv.moisture_min, gpv.moisture_min) AS moisture_min,
-                   COALESCE(pv.moisture_max, gpv.moisture_max) AS moisture_max,
-                   pv.light_min, pv.light_max,
-                   pv.temp_min, pv.temp_max
-            FROM sensors s
-            JOIN devices d ON s.device_id = d.id
-            LEFT JOIN sensor_plant_assignments spa ON spa.sensor_id = s.id
-            LEFT JOIN plant_varieties pv ON pv.id = spa.variety_id
-            LEFT JOIN plant_types pt ON pt.id = pv.plant_type_id
-            LEFT JOIN plant_types gp ON gp.name = 'General'
-            LEFT JOIN plant_varieties gpv ON gpv.plant_type_id = gp.id AND gpv.name = 'General'
-            WHERE s.id = %s;
-        """, (sensor_id,))
-        row = cur.fetchone()
-
-        if not row:
-            raise HTTPException(status_code=404, detail="Sensor not found")
-        if not auth.user_can_access_device(current_user["user_id"], row[2]):
-            raise HTTPException(status_code=403, detail="Access denied")
-
-        (value, unit, device_uid, emoji, profile_name, 
-         moisture_min, moisture_max, light_min, light_max, 
-         temp_min, temp_max) = row
-
-        if value is None:
-            return {
-                "status": "no_data",
-                "profile": profile_name,
-                "emoji": emoji
-            }
-
-        # Determine moisture status
-        if value < float(moisture_min):
-            moisture_status = "too_dry"
-        elif value > float(moisture_max):
-            moisture_status = "too_wet"
-        else:
-            moisture_status = "ok"
-
+    cur.execute("""
+        SELECT s.last_value, s.unit, d.uid,
+               pt.emoji,
+               COALESCE(pt.name || ' - ' || pv.name, gp.name) AS profile_name,
+               COALESCE(pv.moisture_min, gpv.moisture_min) AS moisture_min,
+               COALESCE(pv.moisture_max, gpv.moisture_max) AS moisture_max,
+               pv.light_min, pv.light_max,
+               pv.temp_min, pv.temp_max
+        FROM sensors s
+        JOIN devices d ON s.device_id = d.id
+        LEFT JOIN sensor_plant_assignments spa ON spa.sensor_id = s.id
+        LEFT JOIN plant_varieties pv ON pv.id = spa.variety_id
+        LEFT JOIN plant_types pt ON pt.id = pv.plant_type_id
+        LEFT JOIN plant_types gp ON gp.name = 'General'
+        LEFT JOIN plant_varieties gpv ON gpv.plant_type_id = gp.id AND gpv.name = 'General'
+        WHERE s.id = %s;
+    """, (sensor_id,))
+    row = cur.fetchone()
+
+    if not row:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+    if not auth.user_can_access_device(current_user["user_id"], row[2]):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    (value, unit, device_uid, emoji, profile_name, 
+     moisture_min, moisture_max, light_min, light_max, 
+     temp_min, temp_max) = row
+
+    if value is None:
         return {
-            "sensor_id": sensor_id,
-            "value": float(value),
-            "unit": unit,
-            "status": moisture_status,
+            "status": "no_data",
             "profile": profile_name,
-            "emoji": emoji,
-            "constraints": {
-                "moisture": {
-                    "min": float(moisture_min),
-                    "max": float(moisture_max),
-                    "status": moisture_status
-                },
-                "light": {
-                    "min": float(light_min) if light_min else None,
-                    "max": float(light_max) if light_max else None
-                } if (light_min or light_max) else None,
-                "temperature": {
-                    "min": float(temp_min) if temp_min else None,
-                    "max": float(temp_max) if temp_max else None
-                } if (temp_min or temp_max) else None
-            }
+            "emoji": emoji
         }
-    finally:
-        conn.close()
+
+    # Determine moisture status
+    if value < float(moisture_min):
+        moisture_status = "too_dry"
+    elif value > float(moisture_max):
+        moisture_status = "too_wet"
+    else:
+        moisture_status = "ok"
+
+    return {
+        "sensor_id": sensor_id,
+        "value": float(value),
+        "unit": unit,
+        "status": moisture_status,
+        "profile": profile_name,
+        "emoji": emoji,
+        "constraints": {
+            "moisture": {
+                "min": float(moisture_min),
+                "max": float(moisture_max),
+                "status": moisture_status
+            },
+            "light": {
+                "min": float(light_min) if light_min else None,
+                "max": float(light_max) if light_max else None
+            } if (light_min or light_max) else None,
+            "temperature": {
+                "min": float(temp_min) if temp_min else None,
+                "max": float(temp_max) if temp_max else None
+            } if (temp_min or temp_max) else None
+        }
+    }
 
 @router.get("/{sensor_id}/moisture-events")
-async def sensor_moisture_events(
+def sensor_moisture_events(
     sensor_id: int,
     hours: int = 24,
-    current_user: Dict = Depends(get_current_user)
+    current_user: Dict = Depends(get_current_user),
+    conn=Depends(get_db),
 ):
     """History of moisture status events for a sensor"""
-    conn = get_connection()
     cur = conn.cursor()
-    try:
-        # Check access
-        cur.execute("""
-            SELECT d.uid FROM sensors s JOIN devices d ON s.device_id = d.id
-            WHERE s.id = %s;
-        """, (sensor_id,))
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Sensor not found")
-        if not auth.user_can_access_device(current_user["user_id"], row[0]):
-            raise HTTPException(status_code=403, detail="Access denied")
-
-        # Get events
-        cur.execute("""
-            SELECT reading, expected_min, expected_max, status, action_taken, created_at
-            FROM moisture_events
-            WHERE sensor_id = %s
-              AND created_at > NOW() - INTERVAL '%s hours'
-            ORDER BY created_at DESC;
-        """, (sensor_id, hours))
-
-        rows = cur.fetchall()
-        return {
-            "sensor_id": sensor_id,
-            "hours": hours,
-            "events": [
-                {
-                    "reading": float(r[0]),
-                    "expected_min": float(r[1]),
-                    "expected_max": float(r[2]),
-                    "status": r[3],
-                    "action_taken": r[4],
-                    "created_at": r[5].isoformat()
-                }
-                for r in rows
-            ]
-        }
-    finally:
-        conn.close()
+    # Check access
+    cur.execute("""
+        SELECT d.uid FROM sensors s JOIN devices d ON s.device_id = d.id
+        WHERE s.id = %s;
+    """, (sensor_id,))
+    row = cur.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+    if not auth.user_can_access_device(current_user["user_id"], row[0]):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    # Get events
+    cur.execute("""
+        SELECT reading, expected_min, expected_max, status, action_taken, created_at
+        FROM moisture_events
+        WHERE sensor_id = %s
+          AND created_at > NOW() - INTERVAL '%s hours'
+        ORDER BY created_at DESC;
+    """, (sensor_id, hours))
+
+    rows = cur.fetchall()
+    return {
+        "sensor_id": sensor_id,
+        "hours": hours,
+        "events": [
+            {
+                "reading": float(r[0]),
+                "expected_min": float(r[1]),
+                "expected_max": float(r[2]),
+                "status": r[3],
+                "action_taken": r[4],
+                "created_at": r[5].isoformat()
+            }
+            for r in rows
+        ]
+    }
 
 # ---------------------------------------------------------
 # Zones
 # ---------------------------------------------------------
 
 @router.put("/{sensor_id}/zone")
-async def assign_sensor_zone(
+def assign_sensor_zone(
     sensor_id: int,
     body: SensorZoneAssign,
-    current_user: Dict = Depends(get_current_user)
+    current_user: Dict = Depends(get_current_user),
+    conn=Depends(get_db),
 ):
     """Assign or clear a zone name on a sensor"""
-    conn = get_connection()
     cur = conn.cursor()
-    try:
-        cur.execute("""
-            SELECT s.id, d.uid FROM sensors s
-            JOIN devices d ON s.device_id = d.id
-            WHERE s.id = %s;
-        """, (sensor_id,))
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Sensor not found")
-        if not auth.user_can_access_device(current_user["user_id"], row[1]):
-            raise HTTPException(status_code=403, detail="Access denied")
-
-        cur.execute("UPDATE sensors SET zone_name = %s WHERE id = %s;", (body.zone_name, sensor_id))
-        conn.commit()
-        return {"message": f"Zone set to '{body.zone_name}'" if body.zone_name else "Zone cleared"}
-    finally:
-        conn.close()
\ No newline at end of file
+    cur.execute("""
+        SELECT s.id, d.uid FROM sensors s
+        JOIN devices d ON s.device_id = d.id
+        WHERE s.id = %s;
+    """, (sensor_id,))
+    row = cur.fetchone()
+    if not row:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+    if not auth.user_can_access_device(current_user["user_id"], row[1]):
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    cur.execute("UPDATE sensors SET zone_name = %s WHERE id = %s;", (body.zone_name, sensor_id))
+    conn.commit()
+    return {"message": f"Zone set to '{body.zone_name}'" if body.zone_name else "Zone cleared"}
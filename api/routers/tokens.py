@@ -1,14 +1,14 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query
 from typing import Dict
 from dependencies import get_current_user
 from models import ApiTokenCreate
-from db import get_connection
+from db import db_conn
 import auth
 
 router = APIRouter(prefix="/api/tokens", tags=["tokens"])
 
 @router.post("/create")
-async def create_token(token_data: ApiTokenCreate, current_user: Dict = Depends(get_current_user)):
+def create_token(token_data: ApiTokenCreate, current_user: Dict = Depends(get_current_user)):
     """
     Create a new API token.
     - If device_uid is provided → device token (admin only)
@@ -21,11 +21,10 @@ async def create_token(token_data: ApiTokenCreate, current_user: Dict = Depends(
         if current_user.get("role") != "sys_admin":
             raise HTTPException(status_code=403, detail="Only admins can create device tokens")
 
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM devices WHERE uid = %s;", (token_data.device_uid,))
-        row = cur.fetchone()
-        conn.close()
+        with db_conn() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT id FROM devices WHERE uid = %s;", (token_data.device_uid,))
+            row = cur.fetchone()
 
         if not row:
             raise HTTPException(status_code=404, detail="Device not found")
@@ -56,33 +55,36 @@ async def create_token(token_data: ApiTokenCreate, current_user: Dict = Depends(
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/list")
-async def list_my_tokens(current_user: Dict = Depends(get_current_user)):
-    """List the current user's API tokens (metadata only — no token values)"""
-    tokens = auth.list_user_tokens(current_user["user_id"])
+def list_my_tokens(
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    current_user: Dict = Depends(get_current_user),
+):
+    """List the current user's API tokens, newest first (metadata only — no token values)"""
+    tokens = auth.list_user_tokens(current_user["user_id"], limit=limit, offset=offset)
     return {"tokens": tokens}
 
 @router.delete("/{token_id}/revoke")
-async def revoke_token(token_id: int, current_user: Dict = Depends(get_current_user)):
+def revoke_token(token_id: int, current_user: Dict = Depends(get_current_user)):
     """Revoke (deactivate) a token — owner or sys_admin only"""
-    conn = get_connection()
-    cur = conn.cursor()
+    with db_conn() as conn:
+        cur = conn.cursor()
 
-    cur.execute("""
-        SELECT token, user_id FROM api_tokens WHERE id = %s;
-    """, (token_id,))
+        cur.execute("""
+            SELECT token_hash, user_id FROM api_tokens WHERE id = %s;
+        """, (token_id,))
 
-    row = cur.fetchone()
-    conn.close()
+        row = cur.fetchone()
 
     if not row:
         raise HTTPException(status_code=404, detail="Token not found")
 
-    token_value, token_user_id = row
+    token_hash, token_user_id = row
 
     if token_user_id != current_user["user_id"] and current_user.get("role") != "sys_admin":
         raise HTTPException(status_code=403, detail="Not authorized to revoke this token")
 
-    success = auth.revoke_api_token(token_value)
+    success = auth.revoke_api_token_hash(bytes(token_hash))
 
     if success:
         return {"message": "Token revoked successfully"}
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Request, HTTPException, status, Depends
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, HTMLResponse
 from fastapi.templating import Jinja2Templates
 from typing import Optional, Dict
+from cachetools import TTLCache
+import threading
 from dependencies import get_optional_user
 import auth
 
@@ -11,6 +13,25 @@ router = APIRouter(tags=["ui"])
 # If you ever move the templates directory, update both this file and app.py.
 templates = Jinja2Templates(directory="/api/templates")
 
+# Rendered pages that only vary by who is looking at them are cached briefly.
+# The key carries every user field the templates print, so an edited name or
+# role can never be served from another user's (or an older) render.
+PAGE_CACHE_TTL = 30
+
+_page_cache = TTLCache(maxsize=1024, ttl=PAGE_CACHE_TTL)
+_page_cache_lock = threading.Lock()
+
+
+def _render_cached(template_name: str, request: Request, user: Dict) -> HTMLResponse:
+    key = (template_name, user["user_id"], user.get("username"), user.get("full_name"), user.get("role"))
+    with _page_cache_lock:
+        body = _page_cache.get(key)
+    if body is None:
+        body = templates.get_template(template_name).render({"request": request, "user": user})
+        with _page_cache_lock:
+            _page_cache[key] = body
+    return HTMLResponse(body)
+
 @router.get("/login")
 def login_page(request: Request):
     return templates.TemplateResponse("login.html", {"request": request})
@@ -25,13 +46,13 @@ def dashboard(request: Request, current_user: Optional[Dict] = Depends(get_optio
 def devices_page(request: Request, current_user: Optional[Dict] = Depends(get_optional_user)):
     if not current_user:
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
-    return templates.TemplateResponse("devices.html", {"request": request, "user": current_user})
+    return _render_cached("devices.html", request, current_user)
 
 @router.get("/sites")
 def sites_page(request: Request, current_user: Optional[Dict] = Depends(get_optional_user)):
     if not current_user:
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
-    return templates.TemplateResponse("sites.html", {"request": request, "user": current_user})
+    return _render_cached("sites.html", request, current_user)
 
 @router.get("/device/{device_id}")
 def device_page(device_id: str, request: Request, current_user: Optional[Dict] = Depends(get_optional_user)):
@@ -59,7 +80,7 @@ def site_page(site_id: int, request: Request, current_user: Optional[Dict] = Dep
 def sensors_page(request: Request, current_user: Optional[Dict] = Depends(get_optional_user)):
     if not current_user:
         return RedirectResponse(url="/login", status_code=status.HTTP_303_SEE_OTHER)
-    return templates.TemplateResponse("sensors.html", {"request": request, "user": current_user})
+    return _render_cached("sensors.html", request, current_user)
 
 @router.get("/users")
 def users_page(request: Request, current_user: Optional[Dict] = Depends(get_optional_user)):
@@ -2,39 +2,35 @@ from fastapi import APIRouter, HTTPException, status, Depends
 from typing import Dict
 from dependencies import require_sys_admin_dep
 from models import UserCreate, UserUpdate
-from db import get_connection
+from db import get_db
 import auth
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
 @router.post("/create")
-async def create_user(user_data: UserCreate, admin: Dict = Depends(require_sys_admin_dep)):
+def create_user(user_data: UserCreate, admin: Dict = Depends(require_sys_admin_dep), conn=Depends(get_db)):
     """Create a new user — sys_admin only"""
-    conn = get_connection()
-    cur = conn.cursor()
-
-    cur.execute("""
-        SELECT username FROM users WHERE username = %s OR email = %s;
-    """, (user_data.username, user_data.email))
-
-    if cur.fetchone():
-        conn.close()
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username or email already exists"
-        )
-
     password_hash = auth.hash_password(user_data.password)
 
+    cur = conn.cursor()
+
+    # Unique username/email constraints make a duplicate insert a no-op,
+    # so two concurrent creates can't both pass a separate existence check
     cur.execute("""
         INSERT INTO users (username, email, password_hash, full_name, role)
         VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT DO NOTHING
         RETURNING id, username, email, full_name, role;
     """, (user_data.username, user_data.email, password_hash, user_data.full_name, user_data.role))
 
     new_user = cur.fetchone()
     conn.commit()
-    conn.close()
+
+    if not new_user:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username or email already exists"
+        )
 
     return {
         "user_id": new_user[0],
@@ -45,10 +41,9 @@ async def create_user(user_data: UserCreate, admin: Dict = Depends(require_sys_a
     }
 
 @router.post("/{user_id}/disable")
-async def disable_user(user_id: int, admin: Dict = Depends(require_sys_admin_dep)):
+def disable_user(user_id: int, admin: Dict = Depends(require_sys_admin_dep), conn=Depends(get_db)):
     """Disable a user account — sys_admin only"""
     try:
-        conn = get_connection()
         cur = conn.cursor()
         
         # Check if user exists
@@ -59,21 +54,17 @@ async def disable_user(user_id: int, admin: Dict = Depends(require_sys_admin_dep
         # Use 'active' column, not 'is_active'
         cur.execute("UPDATE users SET active = FALSE WHERE id = %s;", (user_id,))
         conn.commit()
+        auth.invalidate_user_sessions(user_id)  # log them out of cached sessions
         return {"message": f"User {user_id} disabled"}
         
     except Exception as e:
-        if conn:
-            conn.rollback()
+        conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn:
-            conn.close()
 
 @router.post("/{user_id}/enable")
-async def enable_user(user_id: int, admin: Dict = Depends(require_sys_admin_dep)):
+def enable_user(user_id: int, admin: Dict = Depends(require_sys_admin_dep), conn=Depends(get_db)):
     """Enable a user account — sys_admin only"""
     try:
-        conn = get_connection()
         cur = conn.cursor()
         
         # Check if user exists
@@ -87,17 +78,12 @@ async def enable_user(user_id: int, admin: Dict = Depends(require_sys_admin_dep)
         return {"message": f"User {user_id} enabled"}
         
     except Exception as e:
-        if conn:
-            conn.rollback()
+        conn.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if conn:
-            conn.close()
 
 @router.post("/{user_id}/assign-site/{site_id}")
-async def assign_user_to_site(user_id: int, site_id: int, admin: Dict = Depends(require_sys_admin_dep)):
+def assign_user_to_site(user_id: int, site_id: int, admin: Dict = Depends(require_sys_admin_dep), conn=Depends(get_db)):
     """Grant a user access to a site — sys_admin only"""
-    conn = get_connection()
     cur = conn.cursor()
 
     try:
@@ -108,17 +94,15 @@ async def assign_user_to_site(user_id: int, site_id: int, admin: Dict = Depends(
         """, (user_id, site_id))
 
         conn.commit()
-        conn.close()
+        auth.invalidate_user_access(user_id)
 
         return {"message": f"User {user_id} assigned to site {site_id}"}
     except Exception as e:
-        conn.close()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/{user_id}/unassign-site/{site_id}")
-async def unassign_user_from_site(user_id: int, site_id: int, admin: Dict = Depends(require_sys_admin_dep)):
+def unassign_user_from_site(user_id: int, site_id: int, admin: Dict = Depends(require_sys_admin_dep), conn=Depends(get_db)):
     """Revoke a user's access to a site — sys_admin only"""
-    conn = get_connection()
     cur = conn.cursor()
 
     cur.execute("""
@@ -127,14 +111,13 @@ async def unassign_user_from_site(user_id: int, site_id: int, admin: Dict = Depe
     """, (user_id, site_id))
 
     conn.commit()
-    conn.close()
 
+    auth.invalidate_user_access(user_id)
     return {"message": f"User {user_id} unassigned from site {site_id}"}
 
 @router.get("/list")
-async def list_users(admin: Dict = Depends(require_sys_admin_dep)):
+def list_users(admin: Dict = Depends(require_sys_admin_dep), conn=Depends(get_db)):
     """List all users — sys_admin only"""
-    conn = get_connection()
     cur = conn.cursor()
     try:
         cur.execute("""
@@ -143,7 +126,6 @@ async def list_users(admin: Dict = Depends(require_sys_admin_dep)):
             ORDER BY id;
         """)
         rows = cur.fetchall()
-        conn.close()
         return {
             "users": [
                 {
@@ -159,18 +141,15 @@ async def list_users(admin: Dict = Depends(require_sys_admin_dep)):
             ]
         }
     except Exception as e:
-        conn.close()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/{user_id}")
-async def update_user(user_id: int, user_data: UserUpdate, admin: Dict = Depends(require_sys_admin_dep)):
+def update_user(user_id: int, user_data: UserUpdate, admin: Dict = Depends(require_sys_admin_dep), conn=Depends(get_db)):
     """Update a user's details — sys_admin only"""
-    conn = get_connection()
     cur = conn.cursor()
     try:
         cur.execute("SELECT id FROM users WHERE id = %s;", (user_id,))
         if not cur.fetchone():
-            conn.close()
             raise HTTPException(status_code=404, detail="User not found")
 
         cur.execute(
@@ -178,7 +157,6 @@ async def update_user(user_id: int, user_data: UserUpdate, admin: Dict = Depends
             (user_data.email, user_id)
         )
         if cur.fetchone():
-            conn.close()
             raise HTTPException(status_code=400, detail="Email already in use by another user")
 
         if user_data.password:
@@ -199,7 +177,8 @@ async def update_user(user_id: int, user_data: UserUpdate, admin: Dict = Depends
 
         updated = cur.fetchone()
         conn.commit()
-        conn.close()
+        auth.invalidate_user_access(user_id)  # role may have changed
+        auth.invalidate_user_sessions(user_id)
         return {
             "user_id": updated[0],
             "username": updated[1],
@@ -208,26 +187,21 @@ async def update_user(user_id: int, user_data: UserUpdate, admin: Dict = Depends
             "role": updated[4]
         }
     except HTTPException:
-        conn.close()
         raise
     except Exception as e:
-        conn.close()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/{user_id}")
-async def delete_user(user_id: int, admin: Dict = Depends(require_sys_admin_dep)):
+def delete_user(user_id: int, admin: Dict = Depends(require_sys_admin_dep), conn=Depends(get_db)):
     """Delete a user and all their site assignments — sys_admin only"""
-    conn = get_connection()
     cur = conn.cursor()
     try:
         if user_id == admin["user_id"]:
-            conn.close()
             raise HTTPException(status_code=400, detail="You cannot delete your own account")
 
         cur.execute("SELECT username FROM users WHERE id = %s;", (user_id,))
         row = cur.fetchone()
         if not row:
-            conn.close()
             raise HTTPException(status_code=404, detail="User not found")
 
         username = row[0]
@@ -237,19 +211,17 @@ async def delete_user(user_id: int, admin: Dict = Depends(require_sys_admin_dep)
         cur.execute("DELETE FROM users WHERE id = %s;", (user_id,))
 
         conn.commit()
-        conn.close()
+        auth.invalidate_user_access(user_id)
+        auth.invalidate_user_sessions(user_id)
         return {"message": f"User '{username}' deleted successfully"}
     except HTTPException:
-        conn.close()
         raise
     except Exception as e:
-        conn.close()
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{user_id}/sites")
-async def get_user_sites(user_id: int, admin: Dict = Depends(require_sys_admin_dep)):
+def get_user_sites(user_id: int, admin: Dict = Depends(require_sys_admin_dep), conn=Depends(get_db)):
     """Get all sites assigned to a specific user — sys_admin only"""
-    conn = get_connection()
     cur = conn.cursor()
     try:
         cur.execute("""
@@ -260,7 +232,6 @@ async def get_user_sites(user_id: int, admin: Dict = Depends(require_sys_admin_d
             ORDER BY s.site_code;
         """, (user_id,))
         rows = cur.fetchall()
-        conn.close()
         return {
             "sites": [
                 {"id": r[0], "site_code": r[1], "friendly_name": r[2]}
@@ -268,5 +239,4 @@ async def get_user_sites(user_id: int, admin: Dict = Depends(require_sys_admin_d
             ]
         }
     except Exception as e:
-        conn.close()
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,15 +1,20 @@
 import logging
+import os
 import sys
 
 def setup_logger(name: str):
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
+    # LOG_LEVEL=WARNING quiets the per-request / per-device INFO lines in production
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
     logger.handlers.clear()
+    # Line-buffered stdout gets each record out (e.g. to docker logs) as soon as
+    # it's written, so the handler's own flush after every record is a no-op
+    if hasattr(sys.stdout, "reconfigure"):  # not when stdout has been swapped for a non-file object
+        sys.stdout.reconfigure(line_buffering=True)
     handler = logging.StreamHandler(sys.stdout)
     handler.setFormatter(logging.Formatter(
         fmt="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S"
     ))
-    handler.flush = sys.stdout.flush
     logger.addHandler(handler)
     return logger
@@ -55,13 +55,14 @@
         sensor_name VARCHAR(50) NOT NULL,
         sensor_type VARCHAR(20) NOT NULL,
         value FLOAT,
-        unit VARCHAR(10), 
-        raw JSON
+        unit VARCHAR(10)
     );
 
     CREATE INDEX idx_sensor_data_device_time ON sensor_data(device_id, time DESC);
     CREATE INDEX idx_sensor_data_device_type ON sensor_data(device_id, sensor_type);
     CREATE INDEX idx_sensor_data_device_type_time ON sensor_data(device_id, sensor_type, time DESC);
+    -- sensor_data is append-only, so time tracks physical row order and a BRIN stays tiny
+    CREATE INDEX IF NOT EXISTS idx_sensor_data_time_brin ON sensor_data USING BRIN (time);
 
     ----------------------------------------------------------------------
     -- AUTHENTICATION & AUTHORIZATION
@@ -104,7 +105,7 @@
     -- Create indexes for performance
     CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
     CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
-    CREATE INDEX IF NOT EXISTS idx_sessions_token ON sessions(session_token);
+    CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions(expires_at);  -- session_token is indexed by its UNIQUE constraint
     CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id);
     CREATE INDEX IF NOT EXISTS idx_user_site_assignments_user_id ON user_site_assignments(user_id);
     CREATE INDEX IF NOT EXISTS idx_user_site_assignments_site_id ON user_site_assignments(site_id);
@@ -117,7 +118,7 @@
     -- Create api_tokens table
     CREATE TABLE IF NOT EXISTS api_tokens (
         id SERIAL PRIMARY KEY,
-        token TEXT UNIQUE NOT NULL,
+        token_hash BYTEA UNIQUE NOT NULL,  -- SHA-256 of the raw token, which is never stored
         user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
         device_id INTEGER REFERENCES devices(id) ON DELETE CASCADE,
         name VARCHAR(100) NOT NULL,
@@ -132,10 +133,11 @@
     );
 
     -- Create indexes for performance
-    CREATE INDEX IF NOT EXISTS idx_api_tokens_token ON api_tokens(token);
     CREATE INDEX IF NOT EXISTS idx_api_tokens_user_id ON api_tokens(user_id);
     CREATE INDEX IF NOT EXISTS idx_api_tokens_device_id ON api_tokens(device_id);
-    CREATE INDEX IF NOT EXISTS idx_api_tokens_active ON api_tokens(active);
+    -- Only active tokens can authenticate, so the lookup index leaves revoked ones out
+    CREATE INDEX IF NOT EXISTS idx_api_tokens_hash_active ON api_tokens(token_hash) WHERE active;
+    CREATE INDEX IF NOT EXISTS idx_api_tokens_expires_at ON api_tokens(expires_at) WHERE expires_at IS NOT NULL;
 
     -- ============================================
     -- PLANT PROFILES - NEW HIERARCHICAL STRUCTURE
@@ -474,6 +476,66 @@
     END;
     $$ LANGUAGE plpgsql;
 
+    -- ============================================
+    -- AUTHZ CACHE INVALIDATION
+    -- ============================================
+    -- The API caches roles, site assignments, device sites, sessions and API tokens
+    -- in-process. These triggers NOTIFY 'authz_changed' with the key that went stale
+    -- (user:<id>, device:<uid>, session:<hex token hash>, token:<hex token hash>) so every API worker
+    -- can evict it. Tokens are hashed so raw credentials never go out on the channel.
+
+    CREATE OR REPLACE FUNCTION notify_authz_changed()
+    RETURNS trigger AS $$
+    DECLARE
+        rec RECORD;
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            rec := OLD;
+        ELSE
+            rec := NEW;
+        END IF;
+
+        IF TG_TABLE_NAME = 'users' THEN
+            PERFORM pg_notify('authz_changed', 'user:' || rec.id);
+        ELSIF TG_TABLE_NAME = 'user_site_assignments' THEN
+            PERFORM pg_notify('authz_changed', 'user:' || rec.user_id);
+        ELSIF TG_TABLE_NAME = 'devices' THEN
+            PERFORM pg_notify('authz_changed', 'device:' || rec.uid);
+        ELSIF TG_TABLE_NAME = 'sessions' THEN
+            PERFORM pg_notify('authz_changed', 'session:' || encode(sha256(convert_to(rec.session_token, 'UTF8')), 'hex'));
+        ELSIF TG_TABLE_NAME = 'api_tokens' THEN
+            PERFORM pg_notify('authz_changed', 'token:' || encode(rec.token_hash, 'hex'));
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS trg_users_authz_changed ON users;
+    CREATE TRIGGER trg_users_authz_changed
+        AFTER UPDATE OF username, email, full_name, role, active OR DELETE ON users
+        FOR EACH ROW EXECUTE FUNCTION notify_authz_changed();
+
+    DROP TRIGGER IF EXISTS trg_assignments_authz_changed ON user_site_assignments;
+    CREATE TRIGGER trg_assignments_authz_changed
+        AFTER INSERT OR UPDATE OR DELETE ON user_site_assignments
+        FOR EACH ROW EXECUTE FUNCTION notify_authz_changed();
+
+    DROP TRIGGER IF EXISTS trg_devices_authz_changed ON devices;
+    CREATE TRIGGER trg_devices_authz_changed
+        AFTER INSERT OR UPDATE OF site_id OR DELETE ON devices
+        FOR EACH ROW EXECUTE FUNCTION notify_authz_changed();
+
+    DROP TRIGGER IF EXISTS trg_sessions_authz_changed ON sessions;
+    CREATE TRIGGER trg_sessions_authz_changed
+        AFTER DELETE ON sessions
+        FOR EACH ROW EXECUTE FUNCTION notify_authz_changed();
+
+    -- Not on last_used, which is bumped by every uncached validation
+    DROP TRIGGER IF EXISTS trg_api_tokens_authz_changed ON api_tokens;
+    CREATE TRIGGER trg_api_tokens_authz_changed
+        AFTER UPDATE OF active, scopes, expires_at OR DELETE ON api_tokens
+        FOR EACH ROW EXECUTE FUNCTION notify_authz_changed();
+
     -- ============================================
     -- DEFAULT DATA
     -- ============================================
@@ -517,7 +579,7 @@
     COMMENT ON TABLE sessions IS 'Active user sessions';
     COMMENT ON COLUMN users.role IS 'sys_admin: full access, user: site-restricted access';
     COMMENT ON TABLE api_tokens IS 'API tokens for programmatic access (IoT devices, integrations, etc.)';
-    COMMENT ON COLUMN api_tokens.token IS 'The actual API token (hashed in production)';
+    COMMENT ON COLUMN api_tokens.token_hash IS 'SHA-256 digest of the API token (the raw token is only shown once, at creation)';
     COMMENT ON COLUMN api_tokens.user_id IS 'If token belongs to a user (for user API access)';
     COMMENT ON COLUMN api_tokens.device_id IS 'If token belongs to a device (for device data submission)';
     COMMENT ON COLUMN api_tokens.scopes IS 'Array of permission scopes (read:sensors, write:sensors, etc.)';
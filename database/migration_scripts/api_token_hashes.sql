@@ -0,0 +1,24 @@
+-- ============================================================
+-- MIGRATION: store API tokens as SHA-256 digests only
+-- Run once, then re-run authz_notify_triggers.sql.
+-- Existing tokens keep working: the API hashes the presented token
+-- and looks it up by token_hash.
+-- ============================================================
+
+BEGIN;
+
+ALTER TABLE api_tokens ADD COLUMN IF NOT EXISTS token_hash BYTEA;
+
+UPDATE api_tokens
+SET token_hash = sha256(convert_to(token, 'UTF8'))
+WHERE token_hash IS NULL;
+
+ALTER TABLE api_tokens ALTER COLUMN token_hash SET NOT NULL;
+ALTER TABLE api_tokens ADD CONSTRAINT api_tokens_token_hash_key UNIQUE (token_hash);
+
+-- Drops idx_api_tokens_token and the plaintext copies with it
+ALTER TABLE api_tokens DROP COLUMN token;
+
+COMMENT ON COLUMN api_tokens.token_hash IS 'SHA-256 digest of the API token (the raw token is only shown once, at creation)';
+
+COMMIT;
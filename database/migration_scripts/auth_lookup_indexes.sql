@@ -0,0 +1,17 @@
+-- ============================================================
+-- MIGRATION: leaner indexes for token/session lookups and cleanup
+-- Run after api_token_hashes.sql. Safe to re-run.
+-- ============================================================
+
+-- Only active tokens can authenticate, so the lookup index leaves revoked ones out
+CREATE INDEX IF NOT EXISTS idx_api_tokens_hash_active ON api_tokens(token_hash) WHERE active;
+
+-- A b-tree on a boolean never helped a query; it only cost writes
+DROP INDEX IF EXISTS idx_api_tokens_active;
+
+-- Duplicates the index behind sessions' UNIQUE (session_token) constraint
+DROP INDEX IF EXISTS idx_sessions_token;
+
+-- For the background cleanup of expired rows
+CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions(expires_at);
+CREATE INDEX IF NOT EXISTS idx_api_tokens_expires_at ON api_tokens(expires_at) WHERE expires_at IS NOT NULL;
@@ -0,0 +1,62 @@
+-- ============================================================
+-- MIGRATION: NOTIFY the API when cached authorization data changes
+-- Safe to re-run (CREATE OR REPLACE / DROP TRIGGER IF EXISTS)
+-- Run api_token_hashes.sql first — the api_tokens trigger reads token_hash
+-- ============================================================
+
+-- The API caches roles, site assignments, device sites, sessions and API tokens
+-- in-process. These triggers NOTIFY 'authz_changed' with the key that went stale
+-- (user:<id>, device:<uid>, session:<hex token hash>, token:<hex token hash>) so every API worker
+-- can evict it. Tokens are hashed so raw credentials never go out on the channel.
+
+CREATE OR REPLACE FUNCTION notify_authz_changed()
+RETURNS trigger AS $$
+DECLARE
+    rec RECORD;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        rec := OLD;
+    ELSE
+        rec := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME = 'users' THEN
+        PERFORM pg_notify('authz_changed', 'user:' || rec.id);
+    ELSIF TG_TABLE_NAME = 'user_site_assignments' THEN
+        PERFORM pg_notify('authz_changed', 'user:' || rec.user_id);
+    ELSIF TG_TABLE_NAME = 'devices' THEN
+        PERFORM pg_notify('authz_changed', 'device:' || rec.uid);
+    ELSIF TG_TABLE_NAME = 'sessions' THEN
+        PERFORM pg_notify('authz_changed', 'session:' || encode(sha256(convert_to(rec.session_token, 'UTF8')), 'hex'));
+    ELSIF TG_TABLE_NAME = 'api_tokens' THEN
+        PERFORM pg_notify('authz_changed', 'token:' || encode(rec.token_hash, 'hex'));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_users_authz_changed ON users;
+CREATE TRIGGER trg_users_authz_changed
+    AFTER UPDATE OF username, email, full_name, role, active OR DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION notify_authz_changed();
+
+DROP TRIGGER IF EXISTS trg_assignments_authz_changed ON user_site_assignments;
+CREATE TRIGGER trg_assignments_authz_changed
+    AFTER INSERT OR UPDATE OR DELETE ON user_site_assignments
+    FOR EACH ROW EXECUTE FUNCTION notify_authz_changed();
+
+DROP TRIGGER IF EXISTS trg_devices_authz_changed ON devices;
+CREATE TRIGGER trg_devices_authz_changed
+    AFTER INSERT OR UPDATE OF site_id OR DELETE ON devices
+    FOR EACH ROW EXECUTE FUNCTION notify_authz_changed();
+
+DROP TRIGGER IF EXISTS trg_sessions_authz_changed ON sessions;
+CREATE TRIGGER trg_sessions_authz_changed
+    AFTER DELETE ON sessions
+    FOR EACH ROW EXECUTE FUNCTION notify_authz_changed();
+
+-- Not on last_used, which is bumped by every uncached validation
+DROP TRIGGER IF EXISTS trg_api_tokens_authz_changed ON api_tokens;
+CREATE TRIGGER trg_api_tokens_authz_changed
+    AFTER UPDATE OF active, scopes, expires_at OR DELETE ON api_tokens
+    FOR EACH ROW EXECUTE FUNCTION notify_authz_changed();
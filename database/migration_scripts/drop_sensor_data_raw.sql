@@ -0,0 +1,7 @@
+-- ============================================================
+-- MIGRATION: drop the unused sensor_data.raw column
+-- Nothing writes or reads it, and on an append-only table every
+-- byte of row width costs buffer reads. Safe to re-run.
+-- ============================================================
+
+ALTER TABLE sensor_data DROP COLUMN IF EXISTS raw;
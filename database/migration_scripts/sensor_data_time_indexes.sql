@@ -0,0 +1,11 @@
+-- ============================================================
+-- MIGRATION: time-series indexes on sensor_data
+-- Safe to re-run.
+-- ============================================================
+
+-- Latest/range reads per device: WHERE device_id = ? ORDER BY time DESC
+CREATE INDEX IF NOT EXISTS idx_sensor_data_device_time ON sensor_data(device_id, time DESC);
+
+-- Whole-table time-range scans (cleanup, reporting). Rows are appended in
+-- time order, so a BRIN gives block-range pruning at a fraction of a b-tree's size
+CREATE INDEX IF NOT EXISTS idx_sensor_data_time_brin ON sensor_data USING BRIN (time);
@@ -4,10 +4,12 @@ from sqlalchemy import (
     Float,
     String,
     DateTime,
-    JSON,
     Boolean,
     ForeignKey,
-    UniqueConstraint
+    Index,
+    UniqueConstraint,
+    func,
+    text
 )
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime, timezone
@@ -25,7 +27,8 @@ class Site(Base):
     friendly_name = Column(String)
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
 
-    readings = relationship("SensorData", back_populates="site")
+    # sensor_data grows without bound — never load it through the relationship
+    readings = relationship("SensorData", back_populates="site", lazy="raise")
     devices = relationship("Device", back_populates="site")
 
 # -------------------------
@@ -69,13 +72,20 @@ class Sensor(Base):
 # -------------------------
 class SensorData(Base):
     __tablename__ = "sensor_data"
+    __table_args__ = (
+        # Per-device latest/range reads: WHERE device_id = ? ORDER BY time DESC
+        Index("idx_sensor_data_device_time", "device_id", text("time DESC")),
+        # Append-only, so time follows physical order and a BRIN stays tiny
+        Index("idx_sensor_data_time_brin", "time", postgresql_using="brin"),
+    )
 
     id = Column(Integer, primary_key=True)
 
     site_id = Column(Integer, ForeignKey("sites.id"), nullable=False)
     device_id = Column(Integer, ForeignKey("devices.id"), nullable=False)
 
-    time = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    # Stamped by Postgres (DEFAULT NOW()), so bulk inserts don't build a datetime per row
+    time = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
     sensor_id = Column(String, nullable=False)
     sensor_name = Column(String, nullable=False)     # e.g. "soil_moisture"
@@ -83,7 +93,7 @@ class SensorData(Base):
     value = Column(Float, nullable=False)     # e.g. 42.5
     unit = Column(String, nullable=True)             # e.g. "%"
 
-    raw = Column(JSON)
-
-    site = relationship("Site", back_populates="readings")
-    device = relationship("Device")
\ No newline at end of file
+    # Readings are written in bulk by the MQTT listener and read in SQL; an accidental
+    # per-row lazy load of these would be an N+1 query, so it raises instead
+    site = relationship("Site", back_populates="readings", lazy="raise")
+    device = relationship("Device", lazy="raise")
\ No newline at end of file
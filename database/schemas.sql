@@ -35,9 +35,7 @@ CREATE TABLE sensor_data (
     -- Your requested data structure:
     sensor_name VARCHAR(50) NOT NULL,        -- e.g. "soil_moisture"
     sensor_value DOUBLE PRECISION NOT NULL,  -- e.g. "42.5"
-    unit VARCHAR(20),                        -- e.g. "%"
-
-    raw JSONB
+    unit VARCHAR(20)                         -- e.g. "%"
 );
 
 CREATE INDEX idx_sensor_data_site_time ON sensor_data(site_id, timestamp);
@@ -99,7 +97,7 @@ CREATE TABLE IF NOT EXISTS sessions (
 -- Create indexes for performance
 CREATE INDEX IF NOT EXISTS idx_users_username ON users(username);
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
-CREATE INDEX IF NOT EXISTS idx_sessions_token ON sessions(session_token);
+CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions(expires_at);  -- session_token is indexed by its UNIQUE constraint
 CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions(user_id);
 CREATE INDEX IF NOT EXISTS idx_user_site_assignments_user_id ON user_site_assignments(user_id);
 CREATE INDEX IF NOT EXISTS idx_user_site_assignments_site_id ON user_site_assignments(site_id);
@@ -150,7 +148,7 @@ COMMENT ON COLUMN users.role IS 'sys_admin: full access, user: site-restricted a
 -- Create api_tokens table
 CREATE TABLE IF NOT EXISTS api_tokens (
     id SERIAL PRIMARY KEY,
-    token VARCHAR(64) UNIQUE NOT NULL,
+    token_hash BYTEA UNIQUE NOT NULL,  -- SHA-256 of the raw token, which is never stored
     user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     device_id INTEGER REFERENCES devices(id) ON DELETE CASCADE,
     name VARCHAR(100) NOT NULL,
@@ -165,10 +163,11 @@ CREATE TABLE IF NOT EXISTS api_tokens (
 );
 
 -- Create indexes for performance
-CREATE INDEX IF NOT EXISTS idx_api_tokens_token ON api_tokens(token);
 CREATE INDEX IF NOT EXISTS idx_api_tokens_user_id ON api_tokens(user_id);
 CREATE INDEX IF NOT EXISTS idx_api_tokens_device_id ON api_tokens(device_id);
-CREATE INDEX IF NOT EXISTS idx_api_tokens_active ON api_tokens(active);
+-- Only active tokens can authenticate, so the lookup index leaves revoked ones out
+CREATE INDEX IF NOT EXISTS idx_api_tokens_hash_active ON api_tokens(token_hash) WHERE active;
+CREATE INDEX IF NOT EXISTS idx_api_tokens_expires_at ON api_tokens(expires_at) WHERE expires_at IS NOT NULL;
 
 -- Function to clean up expired tokens
 CREATE OR REPLACE FUNCTION cleanup_expired_tokens()
@@ -19,12 +19,31 @@ DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 # Create SQLAlchemy engine
 # ----------------------------------------------------------------------------
 # pool_pre_ping=True prevents stale connections
+# pool_size/max_overflow size the pool for bursts of concurrent sensor writes
+# pool_recycle=1800 replaces connections before server/proxy idle timeouts drop them
+# pool_use_lifo=True reuses the warmest connection and lets spare ones idle out
+# executemany_mode="values_plus_batch" sends bulk inserts as multi-row VALUES
+# insertmanyvalues_page_size caps rows per multi-row INSERT statement
+# isolation_level is pinned so behaviour doesn't depend on server defaults
+# query_cache_size keeps compiled SQL for the repeated insert/select shapes
 # future=True enables SQLAlchemy 2.x style API
 # ----------------------------------------------------------------------------
 
+POOL_SIZE = int(os.getenv("PSQL_POOL_SIZE", "20"))
+POOL_MAX_OVERFLOW = int(os.getenv("PSQL_POOL_MAX_OVERFLOW", "40"))
+INSERT_PAGE_SIZE = int(os.getenv("PSQL_INSERT_PAGE_SIZE", "1000"))
+
 engine = create_engine(
     DATABASE_URL,
     pool_pre_ping=True,
+    pool_size=POOL_SIZE,
+    max_overflow=POOL_MAX_OVERFLOW,
+    pool_recycle=1800,
+    pool_use_lifo=True,
+    executemany_mode="values_plus_batch",
+    insertmanyvalues_page_size=INSERT_PAGE_SIZE,
+    isolation_level="READ COMMITTED",
+    query_cache_size=1200,
     future=True
 )
 
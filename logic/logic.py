@@ -1,17 +1,38 @@
+import logging
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import paho.mqtt.client as mqtt
 from itertools import groupby
 from utils.logging import setup_logger
 
+# orjson encodes straight to bytes (what paho sends) and parses API responses
+# several times faster than stdlib json; fall back to json if the wheel isn't installed
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+    _loads = json.loads
+
 # -------------------------
 # Config from environment
 # -------------------------
 PUMP_RUN_SECONDS = float(os.getenv("PUMP_RUN_SECONDS", 5))
 RUN_INTERVAL     = int(os.getenv("RUN_INTERVAL", 3600))
 SKIP_INTERVAL    = int(os.getenv("SKIP_INTERVAL", 3600))
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", 8))  # devices fetched in parallel
+DEVICE_CACHE_TTL = int(os.getenv("DEVICE_CACHE_TTL", 300))  # seconds the device list is reused
+READING_SETTLE_SECONDS = float(os.getenv("READING_SETTLE_SECONDS", 2))  # let the listener commit first
+WAKE_MIN_INTERVAL = float(os.getenv("WAKE_MIN_INTERVAL", 30))  # min seconds between reading-triggered passes
 
 # REMOVED: MOISTURE_THRESHOLD = float(40)
 # Thresholds now come from plant profiles in the database via the API.
@@ -34,47 +55,152 @@ logger = setup_logger("logic")
 # MQTT client setup
 # -------------------------
 
+# Devices that have published a moisture reading since the last pass.
+# The main loop wakes on _wake instead of sleeping out the whole RUN_INTERVAL.
+_pending_devices: set[str] = set()
+_pending_lock = threading.Lock()
+_wake = threading.Event()
+
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
         logger.info(f"Connected to MQTT broker at {MQTT_HOST}:{MQTT_PORT}")
+        # Subscribed here so the subscription is restored after a reconnect
+        client.subscribe("sensors/+/data")
     else:
         logger.error(f"MQTT connection failed with rc={rc}")
 
+def on_message(client, userdata, msg):
+    """Queue the publishing device for an immediate check if it sent a moisture reading"""
+    try:
+        data = _loads(msg.payload)
+        if not any(s.get("type") == "moisture" for s in data.get("sensors", [])):
+            return
+        with _pending_lock:
+            _pending_devices.add(data["device_uid"])
+        _wake.set()
+    except Exception as e:
+        logger.warning("Ignoring unreadable reading on %s: %s", msg.topic, e)
+
 mqtt_client = mqtt.Client(client_id="logic-service")
 mqtt_client.username_pw_set(MQTT_USER, MQTT_PASS)
 mqtt_client.on_connect = on_connect
+mqtt_client.on_message = on_message
+# Bound paho's outbound buffers so a slow broker can't grow them without limit
+mqtt_client.max_inflight_messages_set(20)
+mqtt_client.max_queued_messages_set(100)
+mqtt_client.reconnect_delay_set(min_delay=1, max_delay=30)
 mqtt_client.connect(MQTT_HOST, MQTT_PORT, 60)
 mqtt_client.loop_start()
 
+# -------------------------
+# HTTP client
+# -------------------------
+
+# One pooled session for every API call, so each poll reuses open keep-alive
+# connections instead of a fresh DNS lookup + TCP handshake per request
+http = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=2, backoff_factor=0.2),
+)
+http.mount("http://", _adapter)
+http.mount("https://", _adapter)
+
 # -------------------------
 # Pump trigger
 # -------------------------
 
-def trigger_pump(node_id: str, seconds: float):
-    topic = f"pump/{node_id}"
-    payload = {"action": "run", "seconds": seconds}
-    mqtt_client.publish(topic, json.dumps(payload), qos=1)
-    logger.info(f"Published pump command to {topic}: {payload}")
+@lru_cache(maxsize=16)
+def _pump_payload(seconds: float) -> bytes:
+    # In practice only PUMP_RUN_SECONDS is ever used, so this encodes once per process
+    return _dumps({"action": "run", "seconds": seconds})
+
+
+@lru_cache(maxsize=256)
+def _pump_topic(node_id: str) -> str:
+    return f"pump/{node_id}"
+
+
+# node_id → monotonic time its last pump run should have finished.
+# A device whose pump is still running is never sent a second command,
+# however short SKIP_INTERVAL is or however many readings arrive meanwhile.
+_pump_busy_until: dict[str, float] = {}
+
+
+def trigger_pump(node_id: str, seconds: float) -> bool:
+    """
+    Queue a pump run. Returns False if nothing was sent — the pump is still
+    running from the previous command, or paho's outbound queue was full.
+    """
+    now = time.monotonic()
+    if _pump_busy_until.get(node_id, 0) > now:
+        logger.info("Pump on %s still running, not sending another command", node_id)
+        return False
+
+    topic = _pump_topic(node_id)
+    info = mqtt_client.publish(topic, _pump_payload(seconds), qos=1)
+    if info.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+        logger.error("MQTT outbound queue full, dropped pump command to %s", topic)
+        return False
+    # One second of slack for delivery and the node's own start-up
+    _pump_busy_until[node_id] = now + seconds + 1
+    logger.info("Published pump command to %s: run %ss", topic, seconds)
+    return True
 
 # -------------------------
 # Device fetcher
 # -------------------------
 
+# (fetched_at, uids) — the device list rarely changes, so it's reused for DEVICE_CACHE_TTL
+_devices_cache: tuple[float, list[str]] = (0.0, [])
+
+def invalidate_devices():
+    """Force the next get_devices() call to refetch"""
+    global _devices_cache
+    _devices_cache = (0.0, [])
+
 def get_devices(headers: dict) -> list[str]:
     """Return list of device UIDs the logic service can access"""
+    global _devices_cache
+    fetched_at, uids = _devices_cache
+    if uids and time.monotonic() - fetched_at < DEVICE_CACHE_TTL:
+        return uids
+
     try:
-        resp = requests.get(f"{API_URL}/api/devices", headers=headers, timeout=10)
+        resp = http.get(f"{API_URL}/api/devices", headers=headers, timeout=10)
         resp.raise_for_status()
-        return [d["uid"] for d in resp.json().get("devices", [])]
+        uids = [d["uid"] for d in _loads(resp.content).get("devices", [])]
+        _devices_cache = (time.monotonic(), uids)
+        return uids
     except requests.RequestException as e:
         logger.error(f"Failed to fetch devices: {e}")
         return []
 
+def get_sensors(headers: dict) -> list[dict]:
+    """Return every sensor the logic service can access (fetched once per pass, shared by all devices)"""
+    try:
+        # The list is paged, so follow next_after to the last page
+        all_sensors = []
+        params = {}
+        while True:
+            resp = http.get(f"{API_URL}/api/sensors/list", headers=headers, params=params, timeout=10)
+            resp.raise_for_status()
+            page = _loads(resp.content)
+            all_sensors.extend(page.get("sensors", []))
+            if not page.get("next_after"):
+                break
+            params = {"after": page["next_after"]}
+        return all_sensors
+    except requests.RequestException as e:
+        logger.error(f"Failed to fetch sensor list: {e}")
+        return []
+
 # -------------------------
 # Plant-profile-aware moisture check
 # -------------------------
 
-def get_moisture_statuses(device_uid: str, headers: dict) -> list[dict]:
+def get_moisture_statuses(device_uid: str, all_sensors: list[dict], headers: dict) -> list[dict]:
     """
     Fetch per-sensor moisture status, then group by zone_name.
     Sensors in the same zone are averaged before thresholds are applied.
@@ -83,11 +209,6 @@ def get_moisture_statuses(device_uid: str, headers: dict) -> list[dict]:
     """
 
     try:
-        # Get all sensors for this device
-        resp = requests.get(f"{API_URL}/api/sensors/list", headers=headers, timeout=10)
-        resp.raise_for_status()
-        all_sensors = resp.json().get("sensors", [])
-
         # Filter: active moisture sensors on this device only
         moisture_sensors = [
             s for s in all_sensors
@@ -104,29 +225,32 @@ def get_moisture_statuses(device_uid: str, headers: dict) -> list[dict]:
         
         for sensor in moisture_sensors:
             try:
-                resp = requests.get(
+                resp = http.get(
                     f"{API_URL}/api/sensors/{sensor['id']}/moisture-status",
                     headers=headers,
                     timeout=10
                 )
                 if resp.status_code == 200:
-                    data = resp.json()
+                    data = _loads(resp.content)
                     data["zone_name"] = sensor.get("zone_name")
                     data["sensor_name"] = sensor["sensor_name"]
                     raw_statuses.append(data)
                 else:
                     logger.warning(f"moisture-status returned {resp.status_code} for sensor {sensor['id']}")
+                    if resp.status_code == 404:
+                        # Sensor or device has gone away; pick up the change next pass
+                        invalidate_devices()
             except requests.RequestException as e:
                 logger.error(f"Failed to fetch status for sensor {sensor['id']}: {e}")
 
         # ---- Zone averaging ------------------------------------------------
-        # Split into zoned and unzoned sensors
-        zoned   = [s for s in raw_statuses if s.get("zone_name")]
-        unzoned = [s for s in raw_statuses if not s.get("zone_name")]
-
-        results = list(unzoned) # unzoned sensors evaluated individually as before
+        # Split into zoned and unzoned sensors in one pass;
+        # unzoned sensors are evaluated individually as before
+        zoned, results = [], []
+        for s in raw_statuses:
+            (zoned if s.get("zone_name") else results).append(s)
 
-                # Group zoned sensors by zone_name
+        # Group zoned sensors by zone_name
         zoned_sorted = sorted(zoned, key=lambda s: s["zone_name"])
         for zone_name, group in groupby(zoned_sorted, key=lambda s: s["zone_name"]):
             members = list(group)
@@ -149,12 +273,12 @@ def get_moisture_statuses(device_uid: str, headers: dict) -> list[dict]:
                     f"Falling back to General profile."
                 )
                 try:
-                    gp_resp = requests.get(
+                    gp_resp = http.get(
                         f"{API_URL}/api/plant-profiles", headers=headers, timeout=10
                     )
                     gp_resp.raise_for_status()
                     general = next(
-                        (p for p in gp_resp.json().get("plant_profiles", []) if p["name"] == "General"),
+                        (p for p in _loads(gp_resp.content).get("plant_profiles", []) if p["name"] == "General"),
                         {"moisture_min": 30, "moisture_max": 70}  # hard fallback if DB unreachable
                     )
                     moisture_min = general["moisture_min"]
@@ -176,11 +300,12 @@ def get_moisture_statuses(device_uid: str, headers: dict) -> list[dict]:
             sensor_ids = [s["sensor_id"] for s in members]
             sensor_names = [s["sensor_name"] for s in members]
 
-            logger.info(
-                f"  Zone '{zone_name}' [{profile_name}]: "
-                f"avg={avg_value:.1f}% (raw: {[round(v,1) for v in values]}) "
-                f"— status={zone_status} (range {moisture_min}–{moisture_max}%)"
-            )
+            if logger.isEnabledFor(logging.INFO):  # skip building the rounded list when INFO is off
+                logger.info(
+                    "  Zone '%s' [%s]: avg=%.1f%% (raw: %s) — status=%s (range %s–%s%%)",
+                    zone_name, profile_name, avg_value, [round(v, 1) for v in values],
+                    zone_status, moisture_min, moisture_max
+                )
 
             results.append({
                 "sensor_id": sensor_ids,       # list so pump logic can log all
@@ -198,7 +323,7 @@ def get_moisture_statuses(device_uid: str, headers: dict) -> list[dict]:
         return results
 
     except requests.RequestException as e:
-        logger.error(f"Failed to fetch sensor list for {device_uid}: {e}")
+        logger.error(f"Failed to fetch moisture statuses for {device_uid}: {e}")
         return []
 
 # -------------------------
@@ -212,23 +337,49 @@ headers = {
     "Content-Type": "application/json"
 }
 
+# Devices are fetched concurrently — a pass takes about as long as the slowest
+# device rather than the sum of all of them. Pump decisions stay sequential.
+poll_pool = ThreadPoolExecutor(max_workers=POLL_CONCURRENCY, thread_name_prefix="poll")
+
+# Monotonic start times of the last pass of any kind, and of the last full pass.
+# A full pass runs every RUN_INTERVAL however many readings wake the loop
+# in between, so devices that go quiet are still re-checked.
+last_pass = 0.0
+last_full_pass = 0.0
+
 while True:
-    try:
-        for device_uid in get_devices(headers):
-            logger.info(f"Processing device {device_uid}")
+    last_pass = time.monotonic()
+    full_pass = last_pass - last_full_pass >= RUN_INTERVAL
+    if full_pass:
+        last_full_pass = last_pass
 
-            statuses = get_moisture_statuses(device_uid, headers)
+    try:
+        with _pending_lock:
+            woken = set(_pending_devices)
+            _pending_devices.clear()
+
+        device_uids = get_devices(headers)
+        if not full_pass:
+            # Woken by fresh readings: only those devices need a check
+            device_uids = [uid for uid in device_uids if uid in woken]
+        all_sensors = get_sensors(headers) if device_uids else []
+        all_statuses = poll_pool.map(
+            lambda uid: get_moisture_statuses(uid, all_sensors, headers), device_uids
+        )
+
+        for device_uid, statuses in zip(device_uids, all_statuses):
+            logger.info("Processing device %s", device_uid)
 
             if not statuses:
-                logger.warning(f"No active moisture sensors found for {device_uid}")
+                logger.warning("No active moisture sensors found for %s", device_uid)
                 continue
 
             # Log all sensor statuses for visibility
             for s in statuses:
                 logger.info(
-                    f"  Sensor {s['sensor_id']} [{s['profile']}]: "
-                    f"{s['value']}% — status={s['status']} "
-                    f"(range {s['moisture_min']}–{s['moisture_max']}%)"
+                    "  Sensor %s [%s]: %s%% — status=%s (range %s–%s%%)",
+                    s['sensor_id'], s['profile'], s['value'], s['status'],
+                    s['moisture_min'], s['moisture_max']
                 )
 
             dry_sensors = [s for s in statuses if s["status"] == "too_dry"]
@@ -241,24 +392,36 @@ while True:
                     # Log exactly which sensors triggered this and why
                     for s in dry_sensors:
                         logger.warning(
-                            f"💧 {device_uid} sensor {s['sensor_id']} too dry: "
-                            f"{s['value']}% < {s['moisture_min']}% [{s['profile']}]"
+                            "💧 %s sensor %s too dry: %s%% < %s%% [%s]",
+                            device_uid, s['sensor_id'], s['value'], s['moisture_min'], s['profile']
                         )
-                    trigger_pump(device_uid, PUMP_RUN_SECONDS)
-                    last_triggered[device_uid] = current_time
+                    # Only start the debounce if the command actually went out
+                    if trigger_pump(device_uid, PUMP_RUN_SECONDS):
+                        last_triggered[device_uid] = current_time
                 else:
                     remaining = SKIP_INTERVAL - (current_time - last_time)
                     logger.info(
-                        f"Moisture low on {device_uid} but skipping pump "
-                        f"for {remaining:.0f}s more (debounce)"
+                        "Moisture low on %s but skipping pump for %.0fs more (debounce)",
+                        device_uid, remaining
                     )
             else:
-                logger.info(f"✅ All moisture sensors within plant profile thresholds for {device_uid}")
-                last_triggered[device_uid] = 0
+                logger.info("✅ All moisture sensors within plant profile thresholds for %s", device_uid)
+                # Only devices inside their debounce window keep an entry
+                last_triggered.pop(device_uid, None)
 
     except requests.RequestException as e:
         logger.error(f"HTTP/API error: {e}")
     except Exception as e:
         logger.error(f"Logic loop error: {e}")
 
-    time.sleep(RUN_INTERVAL)
+    # Sleep until the next full pass is due, or until a device publishes a
+    # moisture reading. Wake-ups are coalesced: the woken pass waits out
+    # WAKE_MIN_INTERVAL since the last pass (and at least READING_SETTLE_SECONDS,
+    # so the listener has stored the reading), collecting every device that
+    # reports meanwhile — but never past the full-pass deadline.
+    next_full_pass = last_full_pass + RUN_INTERVAL
+    if _wake.wait(max(0.0, next_full_pass - time.monotonic())):
+        now = time.monotonic()
+        delay = max(READING_SETTLE_SECONDS, last_pass + WAKE_MIN_INTERVAL - now)
+        time.sleep(max(0.0, min(delay, next_full_pass - now)))
+        _wake.clear()
@@ -1,11 +1,35 @@
 import paho.mqtt.client as mqtt
 import psycopg2
+import psycopg2.pool
+from psycopg2.extras import execute_values
 import json
 from datetime import datetime, timezone
+from functools import lru_cache
+import io
+import itertools
 import os
+import queue
+import threading
 import time
+import weakref
 from utils.logging import setup_logger
 
+# orjson parses the raw payload bytes directly and several times faster than
+# stdlib json; fall back to json if the wheel isn't installed
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Nodes may publish msgpack instead of JSON on sensors/<uid>/data/msgpack —
+# smaller on the wire and cheaper to parse. Only subscribed when installed.
+try:
+    import msgpack
+    _unpackb = msgpack.unpackb
+except ImportError:
+    _unpackb = None
+
 logger = setup_logger("mqtt_listener")
 
 # Database config
@@ -21,6 +45,9 @@ MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
 MQTT_USER = os.getenv("MQTT_USERNAME", "")  # Empty from your docker-compose
 MQTT_PASS = os.getenv("MQTT_PASSWORD", "")  # Empty from your docker-compose
 
+# Unit stored with each reading, by sensor type
+UNIT_MAP = {"moisture": "%", "temperature": "°C", "light": "lx"}
+
 def wait_for_db():
     """Wait for database readiness"""
     while True:
@@ -33,7 +60,7 @@ def wait_for_db():
             logger.info("Database ready")
             return True
         except Exception as e:
-            logger.info(f"Waiting for database... {e}")
+            logger.info("Waiting for database... %s", e)
             time.sleep(5)
 
 def wait_for_mqtt():
@@ -48,83 +75,180 @@ def wait_for_mqtt():
             logger.info("MQTT broker ready")
             return True
         except Exception as e:
-            logger.info(f"Waiting for MQTT broker... {e}")
+            logger.info("Waiting for MQTT broker... %s", e)
             time.sleep(5)
 
-def connect_db():
-    return psycopg2.connect(
-        host=DB_HOST, port=DB_PORT, user=DB_USER, 
-        password=DB_PASS, database=DB_NAME
+# Connections are kept open in a pool instead of paying TCP + auth + backend
+# startup on every message. Created lazily, after wait_for_db() has succeeded.
+# Messages are processed by LISTENER_WORKERS threads, each holding at most
+# one connection, so the pool must be at least that large. psycopg2 closes
+# connections handed back beyond minconn, so minconn matches it too.
+LISTENER_WORKERS = int(os.getenv("LISTENER_WORKERS", "4"))
+LISTENER_QUEUE_SIZE = int(os.getenv("LISTENER_QUEUE_SIZE", "1000"))  # per worker
+
+POOL_MIN_CONN = int(os.getenv("PSQL_POOL_MIN", str(LISTENER_WORKERS)))
+POOL_MAX_CONN = int(os.getenv("PSQL_POOL_MAX", str(LISTENER_WORKERS)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> psycopg2.pool.ThreadedConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = psycopg2.pool.ThreadedConnectionPool(
+                    minconn=POOL_MIN_CONN, maxconn=POOL_MAX_CONN,
+                    host=DB_HOST, port=DB_PORT, user=DB_USER,
+                    password=DB_PASS, database=DB_NAME
+                )
+    return _pool
+
+def connect_db(verify: bool = False):
+    """
+    Check a connection out of the pool; hand it back with release_db().
+    With verify=True each candidate is pinged first — used after a connection
+    error, when the rest of the idle pool has most likely died with it.
+    """
+    pool = _get_pool()
+    while True:
+        conn = pool.getconn()
+        if not conn.closed:
+            if not verify:
+                return conn
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+                return conn
+            except psycopg2.Error:
+                pass
+        # Dropped while idle (DB restart) — replace it; opening a new
+        # connection raises if the DB is really down, so this can't spin
+        pool.putconn(conn, close=True)
+
+def release_db(conn):
+    """Return a connection to the pool; anything left uncommitted is rolled back"""
+    _get_pool().putconn(conn, close=bool(conn.closed))
+
+# Errors that may mean the connection itself is gone rather than the data being bad
+DB_CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+def _rollback(conn):
+    """Roll back after a failed write; a dead connection can't, and release_db() discards it"""
+    try:
+        conn.rollback()
+    except psycopg2.Error as e:
+        logger.warning("Rollback failed: %s", e)
+
+# Server-side prepared statements: each fixed-shape query on the per-message
+# path is parsed and planned once per connection instead of on every message.
+# Set PSQL_PREPARE=0 behind PgBouncer in transaction mode, where a PREPARE
+# does not outlive its transaction.
+PREPARE_ENABLED = os.getenv("PSQL_PREPARE", "1") != "0"
+
+# connection → names of statements already prepared on it
+_prepared_statements = weakref.WeakKeyDictionary()
+
+def _to_positional(sql: str) -> str:
+    """Rewrite psycopg2 %s placeholders as $1, $2, ... for PREPARE"""
+    counter = itertools.count(1)
+    parts = sql.split("%s")
+    return "".join(
+        part + (f"${next(counter)}" if i < len(parts) - 1 else "")
+        for i, part in enumerate(parts)
     )
 
+def execute_prepared(cur, name: str, sql: str, params: tuple):
+    """Run `sql` (ordinary %s placeholders) as a named prepared statement on cur's connection"""
+    if not PREPARE_ENABLED:
+        cur.execute(sql, params)
+        return
+
+    prepared = _prepared_statements.setdefault(cur.connection, set())
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {_to_positional(sql)}")
+        prepared.add(name)
+
+    cur.execute(_execute_sql(name, len(params)), params)
+
+@lru_cache(maxsize=64)
+def _execute_sql(name: str, n_params: int) -> str:
+    """EXECUTE statement for a prepared query — built once per statement, not per call"""
+    return f"EXECUTE {name} ({', '.join(['%s'] * n_params)})"
+
+# ----------------------------------------------------------------------------
+# sensor_data writes
+# ----------------------------------------------------------------------------
+# A multi-row INSERT is cheapest for a handful of readings; past COPY_MIN_ROWS
+# COPY FROM STDIN wins because Postgres skips per-row statement parsing.
+# ----------------------------------------------------------------------------
+
+COPY_MIN_ROWS = int(os.getenv("COPY_MIN_ROWS", "50"))
+
+SENSOR_DATA_COLUMNS = "site_id, device_id, time, sensor_id, sensor_name, sensor_type, value, unit"
+
+def _copy_field(value) -> str:
+    """Format one value for COPY's text format"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+def write_sensor_rows(cur, rows: list[tuple]):
+    """Insert sensor_data rows (in SENSOR_DATA_COLUMNS order) with INSERT or COPY by batch size"""
+    if len(rows) < COPY_MIN_ROWS:
+        execute_values(cur, f"INSERT INTO sensor_data ({SENSOR_DATA_COLUMNS}) VALUES %s", rows)
+        return
+
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(_copy_field(v) for v in row))
+        buf.write("\n")
+    buf.seek(0)
+    cur.copy_expert(f"COPY sensor_data ({SENSOR_DATA_COLUMNS}) FROM STDIN", buf)
+
 def on_connect(client, userdata, flags, rc):
-    logger.info(f"Connected to MQTT broker: {rc}")
+    logger.info("Connected to MQTT broker: %s", rc)
     if rc == 0:
         client.subscribe("sensors/+/data")
         logger.info("Subscribed to sensors/+/data")
+        if _unpackb is not None:
+            client.subscribe("sensors/+/data/msgpack")
+            logger.info("Subscribed to sensors/+/data/msgpack")
     else:
-        logger.error(f"Connection failed with code {rc}")
-
-def validate_sensor(conn, device_id: int, sensor_id: str, sensor_type: str) -> int | None:
-    """Check if sensor is registered and active. Returns sensor DB id or None."""
-    cur = conn.cursor()
-    
-    cur.execute("""
-        SELECT id, active 
-        FROM sensors 
-        WHERE device_id = %s 
-        AND sensor_name = %s 
-        AND sensor_type = %s
-    """, (device_id, sensor_id, sensor_type))
-    
-    result = cur.fetchone()
-    cur.close()
-    
-    if not result:
-        logger.warning(f"Sensor {sensor_id} ({sensor_type}) not registered for device_id={device_id}")
-        return None
-    
-    sensor_db_id, active = result
-    
-    if not active:
-        logger.warning(f"Sensor {sensor_id} is registered but inactive for device_id={device_id}")
-        return None
-    
-    return sensor_db_id
-
-def activate_device_if_needed(conn, uid: str) -> int | None:
-    cur = conn.cursor()
-
-    cur.execute("SELECT id, active FROM devices WHERE uid = %s;", (uid,))
+        logger.error("Connection failed with code %s", rc)
+
+def activate_device_if_needed(cur, uid: str) -> tuple[int, int | None] | None:
+    """Check a device in by UID. Returns (device_db_id, site_id), or None if it isn't registered."""
+    # Mark the device seen (and active) in one round trip. The self-join
+    # exposes the pre-update row so a first check-in can still be logged.
+    execute_prepared(cur, "device_checkin", """
+        UPDATE devices d
+        SET active = TRUE,
+            last_seen = NOW()
+        FROM devices prev
+        WHERE prev.id = d.id
+        AND d.uid = %s
+        RETURNING d.id, d.site_id, prev.active IS NOT TRUE
+    """, (uid,))
     row = cur.fetchone()
 
     if not row:
-        logger.warning(f"Rejected unknown device UID={uid}")
-        cur.close()
+        logger.warning("Rejected unknown device UID=%s", uid)
         return None
 
-    device_db_id, active = row
+    device_db_id, site_id, was_inactive = row
 
-    if not active:
-        logger.info(f"First check-in for device {uid}, activating")
-        cur.execute("""
-            UPDATE devices
-            SET active = TRUE,
-                last_seen = NOW()
-            WHERE id = %s;
-        """, (device_db_id,))
-    else:
-        cur.execute("""
-            UPDATE devices
-            SET last_seen = NOW()
-            WHERE id = %s;
-        """, (device_db_id,))
+    if was_inactive:
+        logger.info("First check-in for device %s, activating", uid)
 
-    conn.commit()
-    cur.close()
-    return device_db_id
+    # No commit here — _write_batch commits the check-in with the readings
+    return device_db_id, site_id
 
-def evaluate_moisture(conn, sensor_db_id: int, device_db_id: int, value: float):
+def evaluate_moisture(cur, sensor_db_id: int, device_db_id: int, site_id: int, value: float):
     """
     Compare a moisture reading against the sensor's assigned plant profile.
     Falls back to 'General' if no profile is assigned.
@@ -134,12 +258,10 @@ def evaluate_moisture(conn, sensor_db_id: int, device_db_id: int, value: float):
       - Log every reading to moisture_events
       - Emit a warning log if out of range (pump trigger is logic.py's job)
 
-    NOTE: Does NOT commit — caller (on_message) commits once at the end.
+    NOTE: Does NOT commit — caller (_write_batch) commits once at the end.
     """
-    cur = conn.cursor()
-
     # Get thresholds — assigned profile wins, General is the fallback
-    cur.execute("""
+    execute_prepared(cur, "sensor_thresholds", """
         SELECT
             COALESCE(pv.name,         gp.name)          AS profile_name,
             COALESCE(pv.moisture_min, gp.moisture_min)  AS moisture_min,
@@ -153,8 +275,7 @@ def evaluate_moisture(conn, sensor_db_id: int, device_db_id: int, value: float):
 
     row = cur.fetchone()
     if not row:
-        logger.warning(f"Could not resolve plant profile for sensor_id={sensor_db_id}")
-        cur.close()
+        logger.warning("Could not resolve plant profile for sensor_id=%s", sensor_db_id)
         return
 
     profile_name, moisture_min, moisture_max = row
@@ -171,158 +292,296 @@ def evaluate_moisture(conn, sensor_db_id: int, device_db_id: int, value: float):
 
     if status == "too_dry":
         logger.warning(
-            f"💧 sensor_id={sensor_db_id} TOO DRY: {value}% < {moisture_min}% [{profile_name}]"
+            "💧 sensor_id=%s TOO DRY: %s%% < %s%% [%s]", sensor_db_id, value, moisture_min, profile_name
         )
     elif status == "too_wet":
         logger.warning(
-            f"🌊 sensor_id={sensor_db_id} TOO WET: {value}% > {moisture_max}% [{profile_name}]"
+            "🌊 sensor_id=%s TOO WET: %s%% > %s%% [%s]", sensor_db_id, value, moisture_max, profile_name
         )
     else:
         logger.info(
-            f"🌱 sensor_id={sensor_db_id} OK: {value}% within {moisture_min}–{moisture_max}% [{profile_name}]"
+            "🌱 sensor_id=%s OK: %s%% within %s–%s%% [%s]", sensor_db_id, value, moisture_min, moisture_max, profile_name
         )
 
     # Log to moisture_events (no pump trigger — that's logic.py's responsibility)
-    cur.execute("""
+    execute_prepared(cur, "moisture_event_insert", """
         INSERT INTO moisture_events (
             sensor_id, device_id, site_id,
             reading, expected_min, expected_max,
             status, action_taken, last_action_at
         )
         VALUES (
-            %s, %s,
-            (SELECT site_id FROM devices WHERE id = %s),
+            %s, %s, %s,
             %s, %s, %s,
             %s, NULL, NULL
         );
     """, (
-        sensor_db_id, device_db_id, device_db_id,
+        sensor_db_id, device_db_id, site_id,
         value, moisture_min, moisture_max,
         status
     ))
 
-    cur.close()
 
+# ----------------------------------------------------------------------------
+# Worker threads
+# ----------------------------------------------------------------------------
+# on_message runs on paho's network thread; doing the DB work there caps the
+# listener at one message per DB round trip. Messages are handed to worker
+# threads instead, sharded by topic so each device's readings are still
+# written in arrival order. A full queue blocks the network thread, which
+# pushes back on the broker rather than buffering without limit.
+# ----------------------------------------------------------------------------
+
+# Each worker drains up to BATCH_MAX_MESSAGES queued messages, waiting at most
+# BATCH_MAX_WAIT_MS for more after the first, and writes them all in one
+# transaction — under load the commit cost is shared across the batch, while
+# a lone message waits no longer than the window.
+BATCH_MAX_MESSAGES = int(os.getenv("BATCH_MAX_MESSAGES", "100"))
+BATCH_MAX_WAIT = float(os.getenv("BATCH_MAX_WAIT_MS", "20")) / 1000
+
+# Telemetry commits don't wait for the WAL flush: a crash can lose the last
+# fraction of a second of readings (never corrupt them), and commits stop
+# costing an fsync each. Set LISTENER_SYNC_COMMIT=on for fully durable writes.
+LISTENER_SYNC_COMMIT = os.getenv("LISTENER_SYNC_COMMIT", "off").lower()
+
+_worker_queues: list[queue.Queue] = []
+
+def _worker(q: queue.Queue):
+    while True:
+        batch = [q.get()]
+        deadline = time.monotonic() + BATCH_MAX_WAIT
+        while len(batch) < BATCH_MAX_MESSAGES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            process_messages(batch)
+        except Exception as e:
+            # Never let one bad message (or a dropped connection) kill the worker
+            logger.error("Worker error: %s", e)
+
+def start_workers():
+    """Start the message-processing threads. Called once before the MQTT loop."""
+    for i in range(LISTENER_WORKERS):
+        q = queue.Queue(maxsize=LISTENER_QUEUE_SIZE)
+        threading.Thread(target=_worker, args=(q,), name=f"ingest-{i}", daemon=True).start()
+        _worker_queues.append(q)
 
 def on_message(client, userdata, msg):
+    """Queue the message for the worker that owns its topic"""
+    if not _worker_queues:
+        process_messages([msg])  # no workers started — process inline
+        return
+    # Shard on the device segment of sensors/<uid>/..., so a device's JSON and
+    # msgpack messages land on the same worker and stay in order
+    device_key = msg.topic.split("/", 2)[1] if msg.topic.count("/") >= 2 else msg.topic
+    _worker_queues[hash(device_key) % len(_worker_queues)].put(msg)
 
-    """
-    Expected payload:
-    {
-        "device_uid": "device001",
-        "sensors": [
-            {"type": "moisture", "id": "soil-sensor-001", "value": 65},
-            {"type": "moisture", "id": "soil-sensor-002", "value": 72},
-            {"type": "temperature", "id": "temp-sensor-001", "value": 18.2},
-            {"type": "light", "id": "light-sensor-001", "value": 450}
-        ]
-    }
-    """
+def _parse_message(msg):
+    """Decode one MQTT message. Returns (device_uid, data, received_at), or None if it's rejected."""
     try:
-        data = json.loads(msg.payload.decode())
-        logger.info(f"Received: {data} from {msg.topic}")
-        
-        conn = connect_db()
+        if msg.topic.endswith("/msgpack"):
+            data = _unpackb(msg.payload, raw=False)
+        else:
+            data = _loads(msg.payload)
+        # One timestamp for the whole payload — its readings were taken together
+        current_time = datetime.now(timezone.utc)
+        # Per-message payload dump is DEBUG-only — repr of the dict isn't free
+        logger.debug("Received: %s from %s", data, msg.topic)
 
         # Extract UID
         device_uid = data['device_uid']
+        if not isinstance(device_uid, str):
+            logger.error("Rejecting message with non-string device_uid %r from %s", device_uid, msg.topic)
+            return None
 
+        # Checked before touching the pool, so rogue traffic never costs a DB round trip
         if device_uid.endswith("UNKNOWN"):
             logger.error("Device has UNKNOWN serial, rejecting")
-            return # ❌ Stop processing unknown devices
+            return None # ❌ Stop processing unknown devices
+    except Exception as e:
+        logger.error("Error processing message: %s", e)
+        return None
 
-        # Validate + activate device
-        device_db_id = activate_device_if_needed(conn, device_uid)
-        if not device_db_id:
-            conn.close()
-            return  # ❌ Stop processing unknown devices
+    return device_uid, data, current_time
 
-        cur = conn.cursor()
+def _stage_payload(cur, device_uid: str, data: dict, current_time, batch: dict):
+    """
+    Check the device in and validate its readings, adding accepted rows to `batch`.
+    Nothing is written to sensor_data here — _write_batch() does that for the whole batch.
+    """
+    # Validate + activate device; the check-in also returns its site_id,
+    # so no row needs a site lookup of its own
+    device = activate_device_if_needed(cur, device_uid)
+    if not device:
+        return  # ❌ Stop processing unknown devices
+    device_db_id, site_id = device
+
+    # Every sensor registered to this device, fetched once per message
+    # instead of one SELECT per sensor in the payload
+    execute_prepared(
+        cur, "device_sensors",
+        "SELECT sensor_name, sensor_type, id, active FROM sensors WHERE device_id = %s",
+        (device_db_id,)
+    )
+    registered = {(name, stype): (sid, active) for name, stype, sid, active in cur.fetchall()}
 
-        # Track valid and rejected sensors
-        valid_sensors = []
-        rejected_sensors = []
+    # Track valid and rejected sensors
+    valid_sensors = []
+    rejected_sensors = []
+    data_rows, latest, moisture_checks = batch["data_rows"], batch["latest"], batch["moisture_checks"]
+    
+    # Loop through all sensors in the payload
+    for sensor in data.get('sensors', []):
+        # Unpacked once; the rest of the loop works on locals
+        sensor_id = sensor['id']
+        sensor_type = sensor['type']
+        value = sensor['value']
+
+        # Validate sensor registration
+        sensor_db_id, active = registered.get((sensor_id, sensor_type), (None, False))
+        if not sensor_db_id:
+            logger.warning("Sensor %s (%s) not registered for device_id=%s", sensor_id, sensor_type, device_db_id)
+        elif not active:
+            logger.warning("Sensor %s is registered but inactive for device_id=%s", sensor_id, device_db_id)
+        if not (sensor_db_id and active):
+            rejected_sensors.append(f"{sensor_id} ({sensor_type})")
+            continue
         
-        # Loop through all sensors in the payload
-        for sensor in data.get('sensors', []):
-            sensor_id = sensor['id']
-            sensor_type = sensor['type']
-
-            # Validate sensor registration
-            sensor_db_id = validate_sensor(conn, device_db_id, sensor_id, sensor_type)
-            if not sensor_db_id:
-                rejected_sensors.append(f"{sensor_id} ({sensor_type})")
-                continue
-            
-            # Determine unit based on sensor type
-            if sensor['type'] == 'moisture':
-                sensor_unit = '%'
-            elif sensor['type'] == 'temperature':
-                sensor_unit = '°C'
-            elif sensor['type'] == 'light':
-                sensor_unit = 'lx'
-
-            current_time = datetime.now(timezone.utc)
-
-            cur.execute("""
-                INSERT INTO sensor_data (
-                    site_id,
-                    device_id,
-                    time,
-                    sensor_id,
-                    sensor_name,
-                    sensor_type,
-                    value,
-                    unit
-                )
-                VALUES (
-                    (SELECT site_id FROM devices WHERE id = %s),
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s
-                )
-            """, (
-                device_db_id,
-                device_db_id,
-                current_time,
-                sensor_id,
-                sensor_id,              # or a nicer name later
-                sensor['type'],
-                sensor['value'],
-                sensor_unit
-            ))  
-
-            # Update last_value and last_seen in sensors table
-            cur.execute("""
-                UPDATE sensors
-                SET last_value = %s,
-                    last_seen = %s
-                WHERE device_id = %s
-                AND sensor_name = %s
-                AND sensor_type = %s
-            """, (sensor['value'], current_time, device_db_id, sensor_id, sensor_type))
-            
-            if sensor['type'] == 'moisture':
-                evaluate_moisture(conn, sensor_db_id, device_db_id, float(sensor['value']))
-            
-            valid_sensors.append(sensor_id)                 
+        # Determine unit based on sensor type
+        sensor_unit = UNIT_MAP.get(sensor_type)
+        if sensor_unit is None:
+            logger.warning("Sensor %s has unsupported type %s", sensor_id, sensor_type)
+            rejected_sensors.append(f"{sensor_id} ({sensor_type})")
+            continue
+
+        data_rows.append((
+            site_id,
+            device_db_id,
+            current_time,
+            sensor_id,
+            sensor_id,              # or a nicer name later
+            sensor_type,
+            value,
+            sensor_unit
+        ))
+        # Keyed per sensor, so a later payload in the batch overwrites an earlier one
+        latest[(device_db_id, sensor_id, sensor_type)] = (value, current_time)
+
+        if sensor_type == 'moisture':
+            moisture_checks.append((sensor_db_id, device_db_id, site_id, float(value)))
         
-        conn.commit()
-        cur.close()
-        conn.close()
+        valid_sensors.append(sensor_id)                 
+
+    batch["results"].append((device_uid, valid_sensors, rejected_sensors))
+
+def _write_batch(conn, payloads: list[tuple]):
+    """Stage every payload, write all their readings, and commit once"""
+    batch = {"data_rows": [], "latest": {}, "moisture_checks": [], "results": []}
+
+    # One cursor carries every statement in the batch
+    with conn.cursor() as cur:
+        if LISTENER_SYNC_COMMIT != "on":
+            # SET LOCAL lasts for this transaction only, so it also holds behind
+            # PgBouncer in transaction mode
+            cur.execute("SET LOCAL synchronous_commit = off")
 
-        # Log results
+        for device_uid, data, current_time in payloads:
+            _stage_payload(cur, device_uid, data, current_time, batch)
+
+        if batch["data_rows"]:
+            # One multi-row INSERT (or COPY) instead of a round trip per sensor
+            write_sensor_rows(cur, batch["data_rows"])
+
+            # Update last_value and last_seen in sensors table, all in one statement
+            execute_values(cur, """
+                UPDATE sensors
+                SET last_value = v.value,
+                    last_seen = v.seen
+                FROM (VALUES %s) AS v(device_id, sensor_name, sensor_type, value, seen)
+                WHERE sensors.device_id = v.device_id
+                AND sensors.sensor_name = v.sensor_name
+                AND sensors.sensor_type = v.sensor_type
+            """, [key + latest for key, latest in batch["latest"].items()],
+                template="(%s, %s, %s, %s::float8, %s::timestamptz)")
+
+        for sensor_db_id, device_db_id, site_id, value in batch["moisture_checks"]:
+            evaluate_moisture(cur, sensor_db_id, device_db_id, site_id, value)
+
+    conn.commit()
+
+    # Log results
+    for device_uid, valid_sensors, rejected_sensors in batch["results"]:
         if valid_sensors:
-            logger.info(f"✅ Saved {len(valid_sensors)} sensors from {device_uid}: {', '.join(valid_sensors)}")
+            logger.info("✅ Saved %d sensors from %s: %s", len(valid_sensors), device_uid, ", ".join(valid_sensors))
         if rejected_sensors:
-            logger.warning(f"❌ Rejected {len(rejected_sensors)} unregistered sensors from {device_uid}: {', '.join(rejected_sensors)}")
-        
-    except Exception as e:
-        logger.error(f"Error processing message: {e}")
+            logger.warning("❌ Rejected %d unregistered sensors from %s: %s", len(rejected_sensors), device_uid, ", ".join(rejected_sensors))
+
+def process_messages(msgs: list):
+
+    """
+    Store a batch of sensor payloads in one transaction.
+
+    Expected payload:
+    {
+        "device_uid": "device001",
+        "sensors": [
+            {"type": "moisture", "id": "soil-sensor-001", "value": 65},
+            {"type": "moisture", "id": "soil-sensor-002", "value": 72},
+            {"type": "temperature", "id": "temp-sensor-001", "value": 18.2},
+            {"type": "light", "id": "light-sensor-001", "value": 450}
+        ]
+    }
+    """
+    payloads = [p for p in map(_parse_message, msgs) if p is not None]
+    if not payloads:
+        return
+
+    conn = connect_db()
+    try:
+        for attempt in range(2):
+            try:
+                _write_batch(conn, payloads)
+                return
+            except Exception as e:
+                error = e
+            if conn.closed:
+                if attempt or not isinstance(error, DB_CONNECTION_ERRORS):
+                    raise error
+                # The connection died while parked in the pool (DB restart,
+                # failover, idle timeout) — swap it for a fresh one and retry
+                # the whole batch once
+                logger.warning("Lost DB connection (%s), retrying batch of %d messages", error, len(payloads))
+                _get_pool().putconn(conn, close=True)
+                conn = None
+                conn = connect_db(verify=True)
+                continue
+            _rollback(conn)
+            break
+
+        if len(payloads) == 1:
+            logger.error("Error processing message: %s", error)
+            return
+        # One bad payload shouldn't cost the rest of the batch — redo them
+        # one transaction each so only the offender is dropped
+        logger.warning("Batch of %d messages failed (%s), retrying individually", len(payloads), error)
+        for payload in payloads:
+            try:
+                _write_batch(conn, [payload])
+            except Exception as e:
+                if conn.closed:
+                    raise  # the DB went away, not this payload — the rest would fail too
+                _rollback(conn)
+                logger.error("Error processing message: %s", e)
+    finally:
+        # Nothing is committed until the end, so a failure anywhere leaves no
+        # partial writes — release_db() rolls the transaction back
+        if conn is not None:
+            release_db(conn)
 
 if __name__ == "__main__":
     logger.info("Starting MQTT listener...")
@@ -338,6 +597,7 @@ if __name__ == "__main__":
     
     client.on_connect = on_connect
     client.on_message = on_message
+    start_workers()
     
     # Connect and loop
     try:
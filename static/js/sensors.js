@@ -36,10 +36,18 @@ async function loadSensors() {
     const emptyState = document.getElementById('emptyState');
 
     try {
-        const res = await fetch('/api/sensors/list');
-        const data = await res.json();
-
-        allSensors = data.sensors || [];
+        // The list endpoint is paged — follow next_after until the last page
+        allSensors = [];
+        let after = null;
+        do {
+            const url = after
+                ? `/api/sensors/list?after=${encodeURIComponent(after)}`
+                : '/api/sensors/list';
+            const res = await fetch(url);
+            const data = await res.json();
+            allSensors = allSensors.concat(data.sensors || []);
+            after = data.next_after;
+        } while (after);
 
         if (allSensors.length === 0) {
             container.style.display = 'none';